@@ -0,0 +1,119 @@
+'''Images inside ZIP and TAR archives, read without extracting them'''
+
+import os
+import posixpath
+import tarfile
+import zipfile
+
+from defaults import zipExtensions, tarExtensions, compressedTarExtensions
+import stats
+
+
+# kind of archive of a file, by its extension: zip, tar, stream (compressed TAR) or None if it is not an archive
+def archiveKind(path):
+    name = path.lower()
+    for kind, extensions in (('zip', zipExtensions), ('stream', compressedTarExtensions), ('tar', tarExtensions)):
+        if any(name.endswith(extension) for extension in extensions):
+            return kind
+    return None
+
+
+# the path is an archive of images
+def isArchive(path):
+    return archiveKind(path) is not None and os.path.isfile(path)
+
+
+# the archive that contains a member (archive path/member name), or None if the path is not inside an archive
+def containingArchive(path):
+    parent = os.path.dirname(path)
+    while parent != os.path.dirname(parent):
+        if isArchive(parent):
+            return parent
+        parent = os.path.dirname(parent)
+    return None
+
+
+# modification time and size of a file
+# the members of an archive have those of the archive: they only change when the archive changes
+def fileStamp(path):
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        archive = containingArchive(path)
+        if not archive:
+            raise
+        stat = os.stat(archive)
+    return stat.st_mtime_ns, stat.st_size
+
+
+# position of a member in the catalog: as in a folder (see scanner.scanImages), the images of each folder come first,
+# sorted by name, and then those of its subfolders, in the same order
+def memberOrder(name):
+    *folders, fileName = name.split('/')
+    return [(1, folder) for folder in folders] + [(0, fileName)]
+
+
+# name of a member relative to the root of the archive, or None if it is not an image of the catalog
+# the resource forks added by macOS to the ZIP files (__MACOSX, ._ files) are not images
+def memberName(name, recursive):
+    name = posixpath.normpath(name.replace('\\', '/')).lstrip('/')
+    if name.startswith(('__MACOSX/', '../')) or posixpath.basename(name).startswith('._'):
+        return None
+    if not recursive and '/' in name:
+        return None
+    return name
+
+
+# generator of the images of an archive: (path, content)
+# the path of a member is the path of the archive followed by its name, as if the archive were a folder
+# accept is a function that tells if a path is an image of the catalog (see imatologue.validImage),
+# the content of the rest of the members is never read
+# the content of each image is read once, when it is going to be used, and not kept by the archive
+# ZIP and TAR files are read through their index, in the order of a folder (see memberOrder)
+# compressed TAR files can't be read out of order: their images are returned in the order they are stored
+def archiveImages(archive, recursive=False, accept=None):
+    kind = archiveKind(archive)
+
+    if kind == 'zip':
+        with zipfile.ZipFile(archive) as zipArchive:
+            members = [member for member in zipArchive.infolist() if not member.is_dir()]
+            yield from _members(archive, members, lambda member: member.filename, zipArchive.read, recursive, accept)
+
+    elif kind == 'tar':
+        with tarfile.open(archive, 'r:') as tarArchive:
+            members = [member for member in tarArchive.getmembers() if member.isfile()]
+            read = lambda member: tarArchive.extractfile(member).read()
+            yield from _members(archive, members, lambda member: member.name, read, recursive, accept)
+
+    elif kind == 'stream':
+        with tarfile.open(archive, 'r|*') as tarArchive:
+            for member in tarArchive:
+                name = memberName(member.name, recursive) if member.isfile() else None
+                path = name and os.path.join(archive, *name.split('/'))
+                if path and (accept is None or accept(path)):
+                    yield path, _read(tarArchive.extractfile(member).read)
+
+    else:
+        raise Exception(f'{archive} is not an archive')
+
+
+# the images of an indexed archive, in the order of a folder
+# name is a function that returns the name of a member and read one that returns its content
+def _members(archive, members, name, read, recursive, accept):
+    images = []
+    for member in members:
+        imageName = memberName(name(member), recursive)
+        path = imageName and os.path.join(archive, *imageName.split('/'))
+        if path and (accept is None or accept(path)):
+            images.append((memberOrder(imageName), path, member))
+
+    for _, path, member in sorted(images, key=lambda image: image[0]):
+        yield path, _read(read, member)
+
+
+# content of a member, recorded in the unpack stage
+def _read(read, *args):
+    with stats.measure('unpack') as counters:
+        content = read(*args)
+        counters['read'] = len(content)
+    return content
@@ -0,0 +1,247 @@
+'''
+Creation of many catalogs in a single run, sharing the work they have in common.
+The catalogs are described in a job file: a JSON list of lists of arguments or a text file with the arguments
+of a catalog on each line, the same ones as in the command line of imatologue.py.
+All the catalogs are planned together: each image is probed only once and resampled only once for each size
+it has in any of them. Then the catalogs are created by a pool of processes, the largest ones first.
+More information by running the script with the -h parameter.
+'''
+
+import argparse
+import io
+import json
+import os
+import shlex
+import shutil
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout, redirect_stderr
+from multiprocessing import get_context
+
+from defaults import commentChar, headerFlag, megabyte, standardOutput, batchCacheSize, batchProbeChunk
+
+# a catalog of the batch
+# arguments: the ones of the command line of imatologue.py
+# images: paths of its images, in the order they are added (None if they couldn't be listed, see planJob)
+Job = namedtuple('Job', 'arguments args images')
+
+# the arguments of each catalog of a job file
+def readJobs(jobFileName):
+    with open(jobFileName) as jobFile:
+        if jobFileName.endswith('.json'):
+            jobs = json.load(jobFile)
+            if not (isinstance(jobs, list) and all(
+                    isinstance(job, list) and all(isinstance(argument, str) for argument in job) for job in jobs
+            )):
+                raise Exception(f'{jobFileName} must be a JSON list of lists of arguments')
+            return jobs
+
+        # the arguments of a catalog on each line, as in a shell
+        return [
+            shlex.split(line) for line in jobFile if line.strip() and not line.lstrip().startswith(commentChar)
+        ]
+
+
+# the arguments and the images of a catalog
+# the catalogs without their own cache of resampled images use the one of the batch
+# if the arguments are wrong or the images can't be listed, the error will be reported when the catalog is created
+def planJob(arguments, cacheFolder, cacheSize, scanned):
+    from cliparser import parseArgs
+    from imatologue import imagesIterator
+    from archives import isArchive
+
+    try:
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+            args = parseArgs(arguments)
+    except SystemExit:
+        return Job(arguments, None, None)
+
+    if args.outputFileName == standardOutput:
+        raise Exception(f'The catalogs of a batch must be written to files: {shlex.join(arguments)}')
+
+    if not args.cache:
+        arguments = arguments + ['--cache', cacheFolder, '--cacheSize', str(cacheSize // megabyte)]
+        args.cache, args.cacheSize = cacheFolder, cacheSize // megabyte
+
+    # catalogs of the same images only list them once
+    source = (args.fileOrFolder, args.recursive, args.exclude)
+    if source not in scanned and isArchive(args.fileOrFolder):
+        # the images of an archive are read when the catalog is created
+        scanned[source] = None
+    elif source not in scanned:
+        try:
+            with redirect_stdout(io.StringIO()):
+                # the images omitted are reported when the catalog is created
+                scanned[source] = [image for text, image in imagesIterator(*source) if text != headerFlag]
+        except Exception:
+            scanned[source] = None
+
+    return Job(arguments, args, scanned[source])
+
+
+# information (probe.ImageInfo) about some images, by path
+# the images that can't be read are left out, the catalogs that use them will report the error
+def probeImages(paths):
+    from probe import imageInfo
+
+    infos = {}
+    for path in paths:
+        try:
+            infos[path] = imageInfo(path)
+        except Exception:
+            pass
+    return infos
+
+
+# resample an image and add it to a cache of resampled images (see images.prepareImage)
+def resampleImage(imagePath, info, width, height, dpi, imageFormat, quality, optimize, cacheFolder, cacheSize):
+    from cache import openCache
+    from images import prepareImage
+
+    try:
+        prepareImage(
+            imagePath, info, width, height, dpi, imageFormat, quality, openCache(cacheFolder, cacheSize),
+            optimize=optimize
+        )
+    except Exception:
+        pass  # reported when the catalog is created
+
+
+# create a catalog in a process of the pool, with the images already probed (see server.runJob)
+def runBatchJob(arguments, infos):
+    import probe
+    from server import runJob
+
+    probe.knownImages.update(infos)
+    return runJob(arguments)
+
+
+# the resampled images needed by the catalogs: (path, pixel size, format, quality, optimize, cache) -> arguments
+# of resampleImage
+# returns them and the number of images of the catalogs that are resampled
+def resampleTasks(jobs, infos):
+    from imatologue import pageLayout
+    from images import pixels
+    from pipeline import fitImage
+
+    tasks = {}
+    uses = 0
+    for job in jobs:
+        if not (job.images and (job.args.dpi or job.args.optimize)):
+            continue
+        args = job.args
+        page = pageLayout(args)
+        cellIndex = 0
+        for imagePath in job.images:
+            if imagePath not in infos:
+                continue
+            cell = page.cells[cellIndex]
+            cellIndex = (cellIndex + 1) % page.numCells
+
+            info = infos[imagePath]
+            width, height = fitImage((info.width, info.height), cell, args.fontSize)
+            size = (info.width, info.height)
+            if args.dpi:
+                size = min(pixels(width, args.dpi), info.width), min(pixels(height, args.dpi), info.height)
+            key = (imagePath, size, args.imageFormat, args.quality, args.optimize, args.cache)
+            tasks.setdefault(key, (
+                imagePath, info, width, height, args.dpi, args.imageFormat, args.quality, args.optimize,
+                args.cache, args.cacheSize * megabyte
+            ))
+            uses += 1
+
+    return tasks, uses
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description='Create many catalogs sharing the work they have in common.')
+
+    parser.add_argument(
+        'jobFile',
+        help='JSON list of lists of arguments of imatologue.py or text file with the arguments of a catalog per line'
+    )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=0, help='Number of processes of the pool. Default: one per CPU'
+    )
+    parser.add_argument(
+        '--cache',
+        help='Folder of the cache of resampled images of the catalogs without their own --cache. Default: temporary'
+    )
+    parser.add_argument(
+        '--cacheSize', type=int, default=batchCacheSize // megabyte,
+        help=f'Maximum size of the cache of the batch, in MB. Default: {batchCacheSize // megabyte}'
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+
+    arguments = readJobs(args.jobFile)
+    workers = args.workers or os.cpu_count()
+    cacheFolder = args.cache or tempfile.mkdtemp(prefix='imatologue_batch_')
+    failed = 0
+
+    try:
+        with ProcessPoolExecutor(workers, mp_context=get_context('spawn')) as pool:
+            # the images of each catalog
+            start = time.perf_counter()
+            scanned = {}
+            jobs = [
+                planJob(jobArguments, cacheFolder, args.cacheSize * megabyte, scanned) for jobArguments in arguments
+            ]
+
+            # each image is probed once
+            paths = list(dict.fromkeys(path for job in jobs for path in job.images or []))
+            chunks = [paths[n:n + batchProbeChunk] for n in range(0, len(paths), batchProbeChunk)]
+            infos = {}
+            for chunkInfos in pool.map(probeImages, chunks):
+                infos.update(chunkInfos)
+            seconds = time.perf_counter() - start
+            print(f'{len(jobs)} catalog/s of {len(paths)} different image/s probed in {seconds:.2f} s')
+
+            # each image is resampled once for each of its sizes
+            start = time.perf_counter()
+            tasks, uses = resampleTasks(jobs, infos)
+            for future in as_completed([pool.submit(resampleImage, *task) for task in tasks.values()]):
+                future.result()
+            seconds = time.perf_counter() - start
+            print(f'{len(tasks)} resampled image/s for {uses} image/s of the catalogs in {seconds:.2f} s')
+
+            # the largest catalogs first, so that the last ones to finish are short
+            start = time.perf_counter()
+            order = sorted(range(len(jobs)), key=lambda n: -len(jobs[n].images or []))
+            futures = {
+                pool.submit(
+                    runBatchJob, jobs[n].arguments,
+                    {path: infos[path] for path in jobs[n].images or [] if path in infos}
+                ): n for n in order
+            }
+            for future in as_completed(futures):
+                n = futures[future]
+                result = future.result()
+                if result['status'] == 200:
+                    print(
+                        f"{n + 1}: {result['output']}. {result['pages']} page/s containing {result['images']} "
+                        f"image/s in {result['seconds']:.2f} s"
+                    )
+                else:
+                    failed += 1
+                    print(f"{n + 1}: {shlex.join(arguments[n])} has failed: {result['error']}")
+                    print(result['log'])
+            print(f'{len(jobs) - failed} catalog/s created in {time.perf_counter() - start:.2f} s')
+
+    finally:
+        if not args.cache:
+            shutil.rmtree(cacheFolder, ignore_errors=True)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
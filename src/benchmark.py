@@ -0,0 +1,301 @@
+'''
+Benchmark of the creation of catalogs using synthetic collections of images.
+The images are generated locally (sizes, formats, flat or nested folders, list files with captions)
+and each combination of input, page format and grid is measured in its own process.
+The results (images/s, pages/s, peak memory, size of the PDF and time of each stage) are written to a JSON file
+that can be compared with the results of a previous version to detect regressions.
+More information by running the script with the -h parameter.
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import os.path
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import product
+from multiprocessing import get_context
+
+from PIL import Image, ImageDraw
+
+from defaults import pages, defaultFontSize, fieldSeparator, defaultJobs, benchmarkImages, benchmarkSizes, \
+    benchmarkFormats, benchmarkPages, benchmarkGrids, benchmarkInputs, benchmarkFolders, benchmarkTolerance
+from page import Page
+import probe
+import stats
+
+# formats of the generated images: extension and options used to save them
+imageFormats = {
+    'JPG': ('.jpg', dict(format='JPEG', quality=90)),
+    'PNG': ('.png', dict(format='PNG')),
+    'GIF': ('.gif', dict(format='GIF')),
+}
+
+# kinds of input: a flat folder, a folder with subfolders (scanned recursively) or a list file
+inputKinds = ['flat', 'nested', 'list']
+
+
+# a synthetic image: a smooth background of random colors with some shapes on it
+# it compresses like a photograph, not like noise or a flat color
+def syntheticImage(size, generator):
+    # a few random pixels enlarged give a smooth background
+    seed = Image.frombytes('RGB', (4, 4), generator.randbytes(4 * 4 * 3))
+    image = seed.resize(size, Image.BICUBIC)
+
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    for _ in range(8):
+        x, y = generator.randrange(width), generator.randrange(height)
+        radius = generator.randrange(1, max(2, min(width, height) // 4))
+        color = tuple(generator.randrange(256) for _ in range(3))
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+
+    return image
+
+
+# generate a collection of images in folder
+# the sizes ((width, height) in pixels) and formats (see imageFormats) are used in turn
+# with nested, the images are distributed in a tree of subfolders
+# the images that already exist are not written again
+# returns the paths of the images, in the order they were created
+def generateImages(folder, count, sizes, formats, nested=False, seed=0):
+    generator = random.Random(seed)
+    paths = []
+    for n in range(count):
+        size = sizes[n % len(sizes)]
+        extension, options = imageFormats[formats[n % len(formats)]]
+
+        imageFolder = folder
+        if nested:
+            # two levels of subfolders
+            imageFolder = os.path.join(folder, f'group_{n % benchmarkFolders:02d}', f'set_{n // benchmarkFolders % 3}')
+        os.makedirs(imageFolder, exist_ok=True)
+
+        path = os.path.join(imageFolder, f'image_{n:06d}_{size[0]}x{size[1]}_{seed}{extension}')
+        image = syntheticImage(size, generator)  # always generated, so the next images don't depend on the folder
+        if not os.path.isfile(path):
+            # the images of a previous benchmark with the same parameters are reused
+            if options['format'] == 'GIF':
+                image = image.convert('P', palette=Image.ADAPTIVE)
+            image.save(path, **options)
+        paths.append(path)
+
+    return paths
+
+
+# write a list file (see listfiles.parseText) with two captions for each image
+def writeListFile(listName, paths):
+    with open(listName, 'w') as listFile:
+        for n, path in enumerate(paths):
+            fields = [path, f'Image {n + 1}', f'{os.path.basename(path)}']
+            listFile.write(fieldSeparator.join(fields) + '\n')
+
+
+# measure one combination: input (folder or list file), page format and grid
+# it runs in its own process, so the peak memory is the one of this case
+# options are the keyword arguments of createPDF
+def runCase(source, recursive, outputName, pageName, grid, options):
+    # imported here so that the time of importing reportlab is not measured as a stage
+    from imatologue import imagesIterator, createPDF
+
+    stages = {}
+    stats.reset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        # list of images
+        start = time.perf_counter()
+        images = list(imagesIterator(source, recursive))
+        stages['scan'] = time.perf_counter() - start
+
+        # size of the images, reading their headers
+        start = time.perf_counter()
+        for imageText, imagePath in images:
+            probe.imageInfo(imagePath)
+        stages['probe'] = time.perf_counter() - start
+        probe.knownImages.clear()  # the catalog is created as in a normal run
+
+        # creation of the PDF (it probes the images again)
+        pageWidth, pageHeight = pages[pageName]
+        page = Page(pageWidth, pageHeight, cells=grid)
+        start = time.perf_counter()
+        numberOfpages, numberOfimages = createPDF(images, outputName, page, **options)
+        stages['render'] = time.perf_counter() - start
+
+    seconds = stages['scan'] + stages['render']
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # kilobytes in Linux, bytes in macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+
+    return dict(
+        images=numberOfimages,
+        pages=numberOfpages,
+        seconds=seconds,
+        imagesPerSecond=numberOfimages / seconds if seconds else None,
+        pagesPerSecond=numberOfpages / seconds if seconds else None,
+        peakRSS=max(usage.ru_maxrss, children.ru_maxrss) * scale,
+        outputBytes=os.path.getsize(outputName),
+        stages=stages,
+        detail=stats.asDict(),  # the stages recorded by the application (see stats.py)
+    )
+
+
+# a grid: columns x rows
+def grid(value):
+    cols, rows = value.lower().split('x')
+    return int(cols), int(rows)
+
+
+# a size in pixels: width x height
+def size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the creation of catalogs with synthetic images.')
+
+    parser.add_argument(
+        '-n', '--images', type=int, default=benchmarkImages, help='Number of images of each collection'
+    )
+    parser.add_argument(
+        '--sizes', type=size, nargs='+', default=[size(value) for value in benchmarkSizes],
+        help='Sizes of the images in pixels, used in turn: WIDTHxHEIGHT'
+    )
+    parser.add_argument(
+        '--formats', nargs='+', choices=list(imageFormats), default=benchmarkFormats,
+        help='Formats of the images, used in turn'
+    )
+    parser.add_argument(
+        '--inputs', nargs='+', choices=inputKinds, default=benchmarkInputs,
+        help='Kinds of input: flat folder, nested folders (recursive) or list file with captions'
+    )
+    parser.add_argument(
+        '-p', '--pages', nargs='+', choices=list(pages), default=benchmarkPages, help='Page formats'
+    )
+    parser.add_argument(
+        '-g', '--grids', type=grid, nargs='+', default=[grid(value) for value in benchmarkGrids],
+        help='Grids of cells: COLUMNSxROWS'
+    )
+    parser.add_argument('--dpi', type=int, help='Resolution of the resampled images (see imatologue --dpi)')
+    parser.add_argument('-j', '--jobs', type=int, default=defaultJobs, help='Processes preparing the images')
+    parser.add_argument('--repeat', type=int, default=1, help='Times each case is measured, the fastest one is kept')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated images')
+    parser.add_argument('--folder', help='Folder of the generated images, kept after the benchmark. Default: temporary')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='JSON file with the results')
+    parser.add_argument(
+        '--compare',
+        help='JSON file with previous results. The cases that are slower than them are reported and '
+             'the exit status is 1'
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=benchmarkTolerance,
+        help=f'Fraction of images/s lost before a case is a regression. Default: {benchmarkTolerance}'
+    )
+
+    return parser.parse_args(argv)
+
+
+# name of a case, used to compare results
+def caseName(case):
+    return f"{case['input']} {case['page']} {case['grid'][0]}x{case['grid'][1]}"
+
+
+# cases whose images/s are lower than in the previous results, beyond the tolerance
+def regressions(results, previous, tolerance):
+    previousCases = {caseName(case): case for case in previous['cases']}
+    slower = []
+    for case in results['cases']:
+        old = previousCases.get(caseName(case))
+        if old and old['imagesPerSecond'] and case['imagesPerSecond'] < old['imagesPerSecond'] * (1 - tolerance):
+            slower.append((caseName(case), old['imagesPerSecond'], case['imagesPerSecond']))
+    return slower
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+
+    folder = args.folder or tempfile.mkdtemp(prefix='imatologue_benchmark_')
+    outputFolder = tempfile.mkdtemp(prefix='imatologue_benchmark_pdf_')
+
+    options = dict(withBorder=True, withTitle=True, fontSize=defaultFontSize, dpi=args.dpi, jobs=args.jobs)
+
+    try:
+        # the collections
+        start = time.perf_counter()
+        sources = {}
+        for kind in args.inputs:
+            kindFolder = os.path.join(folder, kind)
+            paths = generateImages(kindFolder, args.images, args.sizes, args.formats, kind == 'nested', args.seed)
+            if kind == 'list':
+                listName = os.path.join(folder, 'images.txt')
+                writeListFile(listName, paths)
+                sources[kind] = listName, False
+            else:
+                sources[kind] = kindFolder, kind == 'nested'
+        seconds = time.perf_counter() - start
+        print(f'{len(args.inputs)} collection/s of {args.images} image/s generated in {seconds:.2f} s')
+
+        cases = []
+        for kind, pageName, cells in product(args.inputs, args.pages, args.grids):
+            source, recursive = sources[kind]
+            outputName = os.path.join(outputFolder, 'catalog.pdf')
+            best = None
+            for _ in range(args.repeat):
+                # a new process for each measure, so the peak memory is not the one of a previous case
+                with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+                    result = pool.submit(runCase, source, recursive, outputName, pageName, cells, options).result()
+                if not best or result['seconds'] < best['seconds']:
+                    best = result
+
+            case = dict(input=kind, page=pageName, grid=cells, **best)
+            cases.append(case)
+            print(
+                f"{caseName(case)}: {case['imagesPerSecond']:.1f} images/s, {case['pagesPerSecond']:.2f} pages/s, "
+                f"{case['peakRSS'] / 1024 / 1024:.0f} MB, {case['outputBytes']} bytes, "
+                + ', '.join(f'{stage} {seconds:.2f} s' for stage, seconds in case['stages'].items())
+            )
+
+    finally:
+        shutil.rmtree(outputFolder, ignore_errors=True)
+        if not args.folder:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    results = dict(
+        date=datetime.now().isoformat(timespec='seconds'),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpus=os.cpu_count(),
+        parameters=dict(
+            images=args.images, sizes=args.sizes, formats=args.formats, dpi=args.dpi, jobs=args.jobs,
+            repeat=args.repeat, seed=args.seed
+        ),
+        cases=cases,
+    )
+    with open(args.output, 'w') as outputFile:
+        json.dump(results, outputFile, indent=2)
+    print(f'The results have been written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as previousFile:
+            slower = regressions(results, json.load(previousFile), args.tolerance)
+        for name, old, new in slower:
+            print(f'Regression in {name}: {old:.1f} -> {new:.1f} images/s')
+        if slower:
+            return 1
+        print(f'No regressions compared to {args.compare}')
+
+    return 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
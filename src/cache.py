@@ -0,0 +1,184 @@
+'''Caches of the resampled images: persistent (shared by all the runs) and in memory (shared by a process)'''
+
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+from defaults import defaultCacheSize
+from images import ImageData
+from archives import fileStamp
+
+
+# The cache is a folder of files, one per resampled image (ImageData)
+# The name of each file is a hash of the source image (path, modification time and size)
+# and of the pixel size, format and quality of the resampled image.
+# A file is never modified: it is written to a temporary file and renamed, so several runs can share the cache.
+# Each time an image is read, its modification time is updated.
+# When the cache exceeds its maximum size, the least recently used images are deleted.
+class ThumbnailCache:
+
+    def __init__(self, folder, maxSize=defaultCacheSize):
+        self.folder = folder
+        self.maxSize = maxSize  # in bytes
+        os.makedirs(folder, exist_ok=True)
+        # size of the cache when its folder was last scanned and that size plus the images added since then
+        # by this process (the other processes and runs sharing the folder add their own images)
+        self.scanned = self.size = self._size()
+
+    # the cache is sent to the tasks of a pool (-j, --shards) by its folder: all the tasks run by a process share
+    # the same object (see openCache), so the images they add are counted
+    def __reduce__(self):
+        return openCache, (self.folder, self.maxSize)
+
+    # total size of the files of the cache
+    def _size(self):
+        size = 0
+        for path, _, files in os.walk(self.folder):
+            for fileName in files:
+                if fileName.startswith('.'):
+                    continue
+                try:
+                    size += os.stat(os.path.join(path, fileName)).st_size
+                except FileNotFoundError:
+                    continue
+        return size
+
+    # files of the cache, sorted from the least to the most recently used, and their total size
+    def _entries(self):
+        entries = []
+        for path, _, files in os.walk(self.folder):
+            for fileName in files:
+                if fileName.startswith('.'):
+                    # temporary file, being written by a run
+                    continue
+                try:
+                    stat = os.stat(os.path.join(path, fileName))
+                except FileNotFoundError:
+                    # deleted by another run
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, os.path.join(path, fileName)))
+        entries.sort()
+        return entries, sum(size for _, size, _ in entries)
+
+    # the key of a resampled image
+    # the optimized images (see images.encodeImage) have their own keys
+    def key(self, imagePath, pixelSize, imageFormat, quality, optimize=False):
+        modified, size = fileStamp(imagePath)
+        data = f'{os.path.realpath(imagePath)}|{modified}|{size}|{pixelSize}|{imageFormat}|{quality}'
+        if optimize:
+            data += '|optimize'
+        return hashlib.sha1(data.encode('utf8')).hexdigest()
+
+    # the images are distributed in subfolders to avoid huge folders
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], key)
+
+    # the cached image (ImageData) or None if it is not in the cache
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry:
+                header = json.loads(entry.readline())
+                content = entry.read()
+            os.utime(path)  # most recently used
+        except (FileNotFoundError, ValueError):
+            return None
+
+        header['filters'] = tuple(header['filters'])
+        return ImageData(content=content, **header)
+
+    # add an image (ImageData) to the cache
+    def put(self, key, imageData):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        header = imageData._asdict()
+        content = header.pop('content')
+
+        # the entry is complete when it appears in the cache, other runs never read partial files
+        handle, temporaryPath = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+        with os.fdopen(handle, 'wb') as entry:
+            entry.write(json.dumps(header).encode('utf8') + b'\n')
+            entry.write(content)
+            self.size += entry.tell()
+        os.replace(temporaryPath, path)
+
+        # the folder is scanned again when this process has added a quarter of the room left at the last scan
+        # (at least 1% of the maximum size): the scans get closer as the cache fills up, the images added by the
+        # other processes are found before the cache exceeds its maximum size by much, and the scans stay few
+        if self.size - self.scanned >= max((self.maxSize - self.scanned) / 4, self.maxSize / 100):
+            self.scanned = self.size = self._size()
+        if self.size > self.maxSize:
+            self.evict()
+
+    # delete the least recently used images until the cache is 10% below its maximum size
+    def evict(self):
+        entries, cacheSize = self._entries()
+        for _, size, path in entries:
+            if cacheSize <= self.maxSize * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            cacheSize -= size
+        self.scanned = self.size = cacheSize
+
+
+# the caches of resampled images opened by the process, by folder and maximum size
+caches = {}
+
+
+# the cache of a folder, shared by all the tasks run by the process
+def openCache(folder, maxSize=defaultCacheSize):
+    key = os.path.realpath(folder), maxSize
+    if key not in caches:
+        caches[key] = ThumbnailCache(folder, maxSize)
+    return caches[key]
+
+
+# Cache of the resampled images kept in memory by a long-running process (see server.py), shared by its catalogs
+# The least recently used images are dropped when it exceeds its maximum size (in bytes).
+# The images that are not in memory are looked up in store, a persistent cache (ThumbnailCache), if any,
+# and the new ones are also added to it.
+# When it is sent to another process, only the store is sent: the images in memory stay in this process.
+class MemoryCache:
+
+    key = ThumbnailCache.key
+
+    def __init__(self, maxSize, store=None):
+        self.maxSize = maxSize
+        self.store = store
+        self.entries = OrderedDict()  # key -> ImageData, from the least to the most recently used
+        self.size = 0
+
+    def __reduce__(self):
+        return MemoryCache, (self.maxSize, self.store)
+
+    # the cached image (ImageData) or None if it is not in the cache
+    def get(self, key):
+        imageData = self.entries.get(key)
+        if imageData:
+            self.entries.move_to_end(key)
+        elif self.store:
+            imageData = self.store.get(key)
+            if imageData:
+                self._add(key, imageData)
+        return imageData
+
+    # add an image (ImageData) to the cache
+    def put(self, key, imageData):
+        if self.store:
+            self.store.put(key, imageData)
+        self._add(key, imageData)
+
+    def _add(self, key, imageData):
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key).content)
+        self.entries[key] = imageData
+        self.size += len(imageData.content)
+        while self.size > self.maxSize and self.entries:
+            _, oldest = self.entries.popitem(last=False)
+            self.size -= len(oldest.content)
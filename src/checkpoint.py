@@ -0,0 +1,73 @@
+'''Checkpoints of a catalog being created: the parts already finished and the position in the list of images'''
+
+import json
+import os
+import shutil
+import tempfile
+
+from defaults import checkpointExtension
+
+stateName = 'checkpoint.json'
+
+
+# the checkpoint is a folder next to the PDF, with the same name and a different extension
+# it contains the partial PDFs and the state of the catalog (stateName)
+def checkpointFolder(pdfName):
+    return os.path.splitext(pdfName)[0] + checkpointExtension
+
+
+# path of a partial PDF of the checkpoint
+def partPath(pdfName, partName):
+    return os.path.join(checkpointFolder(pdfName), partName)
+
+
+# the state of the checkpoint of a PDF:
+# {'layout': manifest.catalogLayout, 'source': the list of images, 'parts': names of the partial PDFs, in order,
+#  'pages': pages of the parts, 'images': images added to them, 'last': [text, path] of the last one added}
+# returns None if there is no checkpoint, it can't be read or any of its parts is missing
+def loadCheckpoint(pdfName):
+    try:
+        with open(partPath(pdfName, stateName)) as stateFile:
+            state = json.load(stateFile)
+    except (OSError, ValueError):
+        return None
+    if not all(os.path.isfile(partPath(pdfName, partName)) for partName in state['parts']):
+        return None
+    return state
+
+
+# start the checkpoint of a PDF, replacing the previous one if any
+def newCheckpoint(pdfName, layout, source):
+    removeCheckpoint(pdfName)
+    os.makedirs(checkpointFolder(pdfName))
+    state = dict(layout=layout, source=source, parts=[], pages=0, images=0, last=None)
+    saveCheckpoint(pdfName, state)
+    return state
+
+
+# write the state of a checkpoint, replacing the previous one only when it is complete
+def saveCheckpoint(pdfName, state):
+    folder = checkpointFolder(pdfName)
+    handle, temporaryName = tempfile.mkstemp(dir=folder, prefix='.')
+    with os.fdopen(handle, 'w') as stateFile:
+        json.dump(state, stateFile)
+        stateFile.flush()
+        os.fsync(stateFile.fileno())
+    os.replace(temporaryName, os.path.join(folder, stateName))
+
+
+# record a partial PDF that has been finished: its pages, the number of images added to it and the last one
+# the PDF is written to disk before the state, so a checkpoint never names a part that was not completely written
+def addPart(pdfName, state, partName, pages, images, last):
+    with open(partPath(pdfName, partName), 'rb') as partFile:
+        os.fsync(partFile.fileno())
+    state['parts'].append(partName)
+    state['pages'] += pages
+    state['images'] += images
+    state['last'] = list(last)
+    saveCheckpoint(pdfName, state)
+
+
+# remove the checkpoint of a PDF, when the catalog is complete
+def removeCheckpoint(pdfName):
+    shutil.rmtree(checkpointFolder(pdfName), ignore_errors=True)
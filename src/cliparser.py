@@ -3,9 +3,39 @@
 import argparse
 
 from defaults import pageNames, mm, defaultPageMargin, defaultMargin, defaultGap, defaultPage, \
-    minCols, maxCols, defaultCols, minRows, maxRows, defaultRows,  defaultFontSize, dumpExtension
+    minCols, maxCols, defaultCols, minRows, maxRows, defaultRows,  defaultFontSize, dumpFormats, \
+    imageFormats, defaultImageFormat, defaultQuality, defaultJobs, readAheadPerJob, \
+    defaultShardPages, defaultCacheSize, megabyte, manifestExtension, defaultStreamPages, standardOutput, \
+    statsExtension, defaultPrefetchMemory, defaultWatchDelay, planExtension, quarantineExtension, \
+    defaultCheckpointPages, checkpointExtension
 
-def parseArgs():    
+# a cell spanning several columns and rows: COL,ROW,COLUMNS,ROWS
+def span(value):
+    try:
+        col, row, columns, rows = (int(number) for number in value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not a valid span, use COL,ROW,COLUMNS,ROWS')
+    if min(col, row, columns, rows) < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not a valid span, all the values must be positive')
+    return col, row, columns, rows
+
+
+# an integer between minimum and maximum (without maximum, any integer from minimum)
+def integer(minimum, maximum=None):
+    def value(text):
+        try:
+            number = int(text)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'{text} is not an integer')
+        if number < minimum or (maximum is not None and number > maximum):
+            limits = f'between {minimum} and {maximum}' if maximum is not None else f'at least {minimum}'
+            raise argparse.ArgumentTypeError(f'{text} is not valid, the value must be {limits}')
+        return number
+    return value
+
+
+# argv: list of arguments, the ones of the command line if None
+def parseArgs(argv=None):
 
     parser = argparse.ArgumentParser(description='Create a PDF document from a collection of images')
 
@@ -51,11 +81,22 @@ def parseArgs():
         help=f'Number of rows. Value between {minRows} and {maxRows}. Default: {defaultRows}'
     )
 
+    # a cell can cover several columns and rows, for example to highlight the first image of each page
+    # the cells are numbered from the top left corner, starting at 1
+    parser.add_argument(
+        '--span',
+        type=span,
+        action='append',
+        help='Make the cell in column COL and row ROW (starting at 1) span COLUMNS columns and ROWS rows. '
+             'Format: COL,ROW,COLUMNS,ROWS. Can be repeated'
+    )
+
     # path and name ot the generated PDF
     parser.add_argument(
         '-o',
         '--outputFileName',
-        help='Path and name of the generated PDF'
+        help=f'Path and name of the generated PDF. With {standardOutput}, the PDF is streamed to the standard output '
+             f'(see --stream)'
     )
 
     # if fileOrFolder is a folder and this flag is true, it traverses the folder recursively 
@@ -68,12 +109,23 @@ def parseArgs():
 
     # create a text file with the list of images and their descriptions
     # using the created file as input, the same catalog will be generated
-    # however, the created file may not be the same as the input file: images may have been deleted or text may have been added.
+    # however, the created file may not be the same as the input file:
+    # images may have been deleted or text may have been added.
     parser.add_argument(
         '--dump',
         action='store_true',
-        help=f'Dump the list of images and their description into a file with the extension {dumpExtension}. '
-             'This file can be used to regenerate the catalog'
+        help='Dump the list of images and their description into a file with the extension of its format '
+             '(see --dumpFormat). This file can be used to regenerate the catalog'
+    )
+
+    # the dumped file can also contain the size, format, bytes and hash of the images,
+    # so that they are not probed again when it is used as input
+    parser.add_argument(
+        '--dumpFormat',
+        choices=list(dumpFormats),
+        help='Format of the file created by --dump (implies --dump): text (fields separated by ;), '
+             'jsonl or csv. jsonl and csv contain the size, format and bytes of the images too, and their content '
+             'hash with --dedup. Default: text'
     )
 
     # remove the text of the images
@@ -213,15 +265,226 @@ def parseArgs():
         help='Text pattern. Exclude all images containing this pattern in their full path'
     )
 
+    # resolution of the images in the PDF
+    # each image is resampled to the pixels its cell needs at this resolution before being embedded
+    # by default, the original images are embedded at full size
+    parser.add_argument(
+        '--dpi',
+        type=integer(1),
+        help='Resample the images to this resolution (dots per inch) before adding them to the PDF. '
+             'Default: original images'
+    )
+
+    # format of the resampled images
+    parser.add_argument(
+        '--imageFormat',
+        choices=imageFormats,
+        default=defaultImageFormat,
+        type=str.upper,  # case insensitive
+        help=f'Format of the resampled images. AUTO keeps JPEG images as JPEG and stores the rest without loss. '
+             f'Default: {defaultImageFormat}'
+    )
+
+    # quality of the resampled JPEG images
+    parser.add_argument(
+        '--quality',
+        type=integer(1, 95),
+        default=defaultQuality,
+        help=f'Quality (1-95) of the resampled JPEG images. Default: {defaultQuality}'
+    )
+
+    # number of processes reading, resampling and compressing the images
+    # the images are added to the PDF in the same order, whatever the number of processes
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=integer(0),
+        default=defaultJobs,
+        help=f'Number of processes preparing the images, 0 to use one per CPU. Default: {defaultJobs}'
+    )
+
+    # maximum number of images prepared in advance, it limits the memory used by the processes
+    parser.add_argument(
+        '--readAhead',
+        type=int,
+        help=f'Maximum number of images prepared in advance when using several processes. '
+             f'Default: {readAheadPerJob} per process'
+    )
+
+    # the catalog is split in shards of whole pages, each one rendered by its own process
+    # the partial PDFs are merged into the final document
+    parser.add_argument(
+        '--shards',
+        type=int,
+        help='Number of processes rendering shards of the catalog, that are merged into the final PDF. '
+             'Default: the catalog is rendered by a single process'
+    )
+
+    # number of pages of each shard
+    parser.add_argument(
+        '--shardPages',
+        type=int,
+        default=defaultShardPages,
+        help=f'Number of pages of each shard when using --shards. Default: {defaultShardPages}'
+    )
+
+    # the next image files are read by a pool of threads while the previous images are being drawn
+    # it hides the latency of network file systems and object stores
+    parser.add_argument(
+        '--prefetch',
+        type=int,
+        help='Number of image files read in advance, at the same time. Default: each file is read when it is used'
+    )
+
+    # the memory held by the files read in advance and not yet used is limited
+    parser.add_argument(
+        '--prefetchMemory',
+        type=int,
+        default=defaultPrefetchMemory // megabyte,
+        help=f'Maximum size of the image files read in advance, in MB. Larger files are not read in advance. '
+             f'Default: {defaultPrefetchMemory // megabyte}'
+    )
+
+    # folder where the resampled images are stored to be reused by later runs
+    # it can be shared by several runs at the same time
+    parser.add_argument(
+        '--cache',
+        help='Folder of the cache of resampled images (--dpi), shared by all the runs. Default: no cache'
+    )
+
+    # maximum size of the cache, the least recently used images are deleted when it is exceeded
+    parser.add_argument(
+        '--cacheSize',
+        type=int,
+        default=defaultCacheSize // megabyte,
+        help=f'Maximum size of the cache of resampled images, in MB. Default: {defaultCacheSize // megabyte}'
+    )
+
+    # size, format, color mode and content hash of the images, shared by all the runs (see metadata.py)
+    parser.add_argument(
+        '--metadata',
+        help='SQLite file with the metadata of the images (size, format, color mode and content hash), shared by '
+             'all the runs, so that the images that have not changed are not probed or hashed again. '
+             'Default: no store'
+    )
+
+    # the images are checked before the catalog is created, the damaged ones are left out instead of stopping it
+    parser.add_argument(
+        '--verify',
+        choices=['header', 'decode'],
+        help=f'Check the images before creating the catalog (by -j processes) and leave out the damaged ones, '
+             f'listing them in a JSON file with the extension {quarantineExtension}. header reads the header and '
+             f'looks for the end of the file, decode also decodes all the pixels (slower). Default: not checked'
+    )
+
+    # the images are encoded to make the PDF as small as possible
+    parser.add_argument(
+        '--optimize',
+        action='store_true',
+        help='Make the images as small as possible: JPEG images are encoded again with --quality, photographs '
+             'without transparency are stored as JPEG, gray images with one channel and the streams in binary'
+    )
+
+    # images with the same content (even with different paths) are embedded only once in the PDF
+    parser.add_argument(
+        '--dedup',
+        action='store_true',
+        help='Embed only once the images with the same content'
+    )
+
+    # the PDF is written while it is created, in parts of streamPages pages, so memory does not grow with its size
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='Write the pages to the PDF as soon as they are created, instead of keeping the whole document '
+             'in memory until the end'
+    )
+
+    # number of pages of each part kept in memory when streaming
+    parser.add_argument(
+        '--streamPages',
+        type=int,
+        default=defaultStreamPages,
+        help=f'Number of pages kept in memory when using --stream. Default: {defaultStreamPages}'
+    )
+
+    # the catalog is created in parts, the finished ones are kept so that an interrupted run can be resumed
+    parser.add_argument(
+        '--checkpoint',
+        action='store_true',
+        help=f'Create the catalog in parts of --checkpointPages pages and keep the finished ones in a folder with the '
+             f'extension {checkpointExtension} until the PDF is complete, so that it can be resumed if it is '
+             f'interrupted'
+    )
+
+    # number of pages of each part between checkpoints
+    parser.add_argument(
+        '--checkpointPages',
+        type=int,
+        default=defaultCheckpointPages,
+        help=f'Number of pages of each part when using --checkpoint. Default: {defaultCheckpointPages}'
+    )
+
+    # an interrupted catalog continues from its last checkpoint
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue the catalog from the last checkpoint of an interrupted run with --checkpoint, '
+             'with the same images and layout. Without a checkpoint, it is created from the beginning'
+    )
+
+    # time, calls and bytes of each stage of the creation of the catalog
+    parser.add_argument(
+        '--stats',
+        action='store_true',
+        help=f'Print the time, number of calls and bytes read and written by each stage (scan, probe, resample, '
+             f'draw, save,...) and write them to a JSON file with the extension {statsExtension}'
+    )
+
+    # only the pages whose images have changed since the previous run are created again
+    # the rest are copied from the previous PDF
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help=f'Update the catalog created by a previous run with --incremental, creating again only the pages '
+             f'whose images have changed. The images of each page are recorded in a file with the extension '
+             f'{manifestExtension}'
+    )
+
+    # the pages and cells of the images and the size of the PDF are calculated without creating it
+    parser.add_argument(
+        '--plan',
+        action='store_true',
+        help=f'Do not create the PDF, write the page and cell of each image and the estimated size of the PDF to a '
+             f'JSON file with the extension {planExtension} (to the standard output with -o -)'
+    )
+
+    # the catalog is updated (--incremental) each time the images change, until the program is interrupted
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Watch the folder (and its subfolders with -r) or the list file and update the catalog incrementally '
+             'each time the images change'
+    )
+
+    # the changes are grouped: the catalog is updated when there have been no changes for a while
+    parser.add_argument(
+        '--watchDelay',
+        type=float,
+        default=defaultWatchDelay,
+        help=f'Seconds without changes before the catalog is updated when using --watch. Default: {defaultWatchDelay}'
+    )
+
     # file or folder to be processed
     # in the case of a folder, all images with the allowed extensions will be added to the catalog
     # the folder will be traversed recursively if the -r flag is used
     # in the case of a file, each line of the file is a list of fields separated by semicolons
     # only the first field is mandatory and it is the path to the image
-    # the rest of the fields, if any, are strings and will be used as the image description, each field on its own line, from top to bottom.
+    # the rest of the fields, if any, are strings and will be used as the image description,
+    # each field on its own line, from top to bottom.
     parser.add_argument(
         'fileOrFolder',
-        help='File or folder containing the image collection'
+        help='List file, folder or ZIP or TAR archive containing the image collection'
     )
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
@@ -1,9 +1,37 @@
 '''Default values'''
 
-from reportlab.lib.units import mm
-from reportlab.lib.pagesizes import A0, A1, A2, A3, A4, A5, A6, B0, B1, B2, B3, B4, B5, B6, legal, letter, landscape
 from datetime import datetime
 
+# units of measurement in points, the same values as in reportlab (reportlab.lib.units)
+# they are defined here so that the modules that don't create the PDF don't load reportlab (see planner.py)
+inch = 72.0
+cm = inch / 2.54
+mm = cm * 0.1
+
+# page sizes in points (width, height), the same values as in reportlab (reportlab.lib.pagesizes)
+A0 = (841 * mm, 1189 * mm)
+A1 = (594 * mm, 841 * mm)
+A2 = (420 * mm, 594 * mm)
+A3 = (297 * mm, 420 * mm)
+A4 = (210 * mm, 297 * mm)
+A5 = (148 * mm, 210 * mm)
+A6 = (105 * mm, 148 * mm)
+B0 = (1000 * mm, 1414 * mm)
+B1 = (707 * mm, 1000 * mm)
+B2 = (500 * mm, 707 * mm)
+B3 = (353 * mm, 500 * mm)
+B4 = (250 * mm, 353 * mm)
+B5 = (176 * mm, 250 * mm)
+B6 = (125 * mm, 176 * mm)
+legal = (8.5 * inch, 14 * inch)
+letter = (8.5 * inch, 11 * inch)
+
+
+# the page size oriented horizontally
+def landscape(pageSize):
+    width, height = pageSize
+    return (height, width) if width < height else (width, height)
+
 
 # author and application name
 # showed in the generated PDF
@@ -37,12 +65,147 @@ defaultCols = 3
 # allowed image formats
 imageFileExtensions = ['.jpg', '.png', '.gif']
 
+# archives that can be used instead of a folder of images, read without extracting them (see archives.py)
+# ZIP and uncompressed TAR files are read through their index, compressed TAR files as a stream
+zipExtensions = ['.zip']
+tarExtensions = ['.tar']
+compressedTarExtensions = ['.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz']
+
+# number of threads listing the folders of images when they are scanned recursively
+scanThreads = 16
+
+# formats used to re-encode the images when they are resampled (--dpi)
+# AUTO keeps JPEG sources as JPEG and stores any other image losslessly
+imageFormats = ['AUTO', 'JPEG', 'PNG']
+defaultImageFormat = imageFormats[0]  # AUTO
+
+# quality of the re-encoded JPEG images
+defaultQuality = 85
+
+# optimization of the images (--optimize): images with more colors than photoColors are considered photographs
+# and stored as JPEG, RGB images whose chroma (Cb and Cr) is within grayTolerance of neutral are stored as gray
+photoColors = 4096
+grayTolerance = 3
+
+# points per inch, used to convert the size of a cell to pixels
+pointsPerInch = inch
+
+# number of processes preparing the images
+defaultJobs = 1
+
+# images prepared in advance by each process, when the read-ahead window is not given
+readAheadPerJob = 4
+
+# pages of each shard when the catalog is rendered in several processes (--shards)
+defaultShardPages = 50
+
+# maximum size of the cache of resampled images, in megabytes (--cacheSize)
+megabyte = 1024 * 1024
+defaultCacheSize = 1024 * megabyte
+
+# maximum size of the image files read in advance and not yet used (--prefetchMemory)
+defaultPrefetchMemory = 256 * megabyte
+
+# size of the blocks read to compute the content hash of the images
+hashBlockSize = 1024 * 1024
+
+# names of the forms shared by all the pages of the PDF: background and header, borders of the cells
+templateForm = 'pageTemplate'
+bordersForm = 'cellBorders'
+
+# number of pages of each part of the PDF kept in memory when it is streamed
+defaultStreamPages = 20
+
+# maximum number of probed images whose information is kept in memory (see probe.knownImages)
+knownImagesLimit = 100000
+
+# name of the output file to write the PDF to the standard output
+standardOutput = '-'
+
+# benchmark (benchmark.py): number, sizes and formats of the generated images, kinds of input,
+# page formats and grids measured, subfolders of the nested collections
+# and fraction of images/s that can be lost before a case is considered a regression
+benchmarkImages = 200
+benchmarkSizes = ['640x480', '1920x1080']
+benchmarkFormats = ['JPG', 'PNG', 'GIF']
+benchmarkInputs = ['flat', 'nested', 'list']
+benchmarkPages = ['A4']
+benchmarkGrids = ['3x4', '6x8']
+benchmarkFolders = 10
+benchmarkTolerance = 0.1
+
+# minimum time between two lines of progress, in seconds
+progressInterval = 1.0
+
+# catalog server (server.py): address it listens on, processes creating catalogs at the same time
+# and memory of each process for the resampled images
+serverHost = '127.0.0.1'
+serverPort = 8470
+serverWorkers = 2
+serverMemory = 256 * megabyte
+
+# batch of catalogs (batch.py): maximum size of the cache of resampled images shared by the catalogs
+# that don't have their own cache (--cache) and number of images probed by each task of the pool
+batchCacheSize = 4096 * megabyte
+batchProbeChunk = 64
+
+# watch mode (--watch): seconds without changes before the catalog is updated (--watchDelay),
+# maximum seconds the update can be delayed by changes that don't stop
+# and seconds between two scans of the folder when it can't be watched with inotify
+defaultWatchDelay = 2.0
+watchMaxDelay = 60.0
+watchInterval = 5.0
+
+# plan of a catalog (--plan): estimated bytes per pixel of the RGB images encoded as JPEG and losslessly
+# (the gray ones use a third), bytes of each page without its images and extension of the file with the plan
+planJPEGBytesPerPixel = 0.25
+planLosslessBytesPerPixel = 2.0
+planPageBytes = 2000
+planExtension = '.plan.json'
+
+# store of the metadata of the images (--metadata, see metadata.py): seconds a process waits for the others to write
+# and rows written in each transaction
+metadataTimeout = 30.0
+metadataBatch = 256
+
+# verification of the images before the catalog is created (--verify): images checked by each task of the pool,
+# bytes at the end of each file where the end marker of its format is searched (files truncated while copied lack it,
+# a GIF ends with an empty block and its trailer) and extension of the report with the images left out
+verifyChunk = 64
+verifyTailBytes = 64 * 1024
+verifyEndMarkers = {'JPEG': b'\xff\xd9', 'PNG': b'IEND', 'GIF': b'\x00\x3b'}
+quarantineExtension = '.quarantine.json'
+
+# extension of the file with the statistics of a run (--stats)
+statsExtension = '.stats.json'
+
+# extension of the manifest of a catalog, used to update it incrementally
+manifestExtension = '.manifest.json'
+
+# pages of each part of a catalog created with checkpoints (--checkpoint) and extension of the folder next to the PDF
+# where the finished parts and the position in the list of images are kept until the catalog is complete
+defaultCheckpointPages = 100
+checkpointExtension = '.checkpoint'
+
 # when using an input file, each line of the file is a list of fields separated by a separator
 # only the first field is mandatory and it is the path to the image
 # the rest of the fields, if any, are strings and will be used as the image description instead of the file names
 # here, we define the field separator
 fieldSeparator = ';'
 
+# list files with other formats, by extension: JSON lines and CSV (with a first line naming the columns)
+# besides the path and text of the images, they can contain their size, format, bytes and content hash,
+# so that the images don't have to be probed again (see listfiles.py and --dumpFormat)
+listFormats = {'.jsonl': 'jsonl', '.csv': 'csv'}
+# formats of the file created by --dump and their extensions
+dumpFormats = {'text': '.txt', 'jsonl': '.jsonl', 'csv': '.csv'}
+# columns of the CSV files written by --dump, only path is mandatory when reading them
+csvColumns = ['path', 'text', 'width', 'height', 'format', 'mode', 'baseline', 'bytes', 'hash']
+# the list files are read in chunks of listChunkSize bytes,
+# parsed by a pool of processes (-j) when the file is larger than listParallelSize
+listChunkSize = 4 * megabyte
+listParallelSize = 64 * megabyte
+
 # default font name and size
 defaultFontName = 'Helvetica'
 defaultFontSize = 10
@@ -65,9 +228,6 @@ defaultName = 'catalogue'
 # default catalog extension
 defaultExtension = '.pdf'
 
-# extension of output text files
-dumpExtension = '.txt'
-
 nameSeparator = '_'
 wordSeparator = ' '
 
@@ -0,0 +1,279 @@
+'''Preparation of the images before they are embedded in the PDF'''
+
+# reportlab is only imported by the functions that write to the PDF,
+# the modules that only need the geometry and the sizes of the images don't load it (see planner.py)
+
+import hashlib
+import math
+import mmap
+import os
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+from io import BytesIO
+
+from PIL import Image
+
+from defaults import defaultImageFormat, defaultQuality, pointsPerInch, photoColors, grayTolerance
+from probe import imageInfo, imageSource
+import stats
+
+
+# an image ready to be embedded in the PDF as an image XObject
+# name: unique name of the image, derived from its content
+# width, height: size of the image in pixels
+# colorSpace: PDF color space (DeviceRGB or DeviceGray)
+# filters: PDF filters needed to decode the content
+# content: the encoded pixels
+ImageData = namedtuple('ImageData', 'name width height colorSpace filters content')
+
+# prefix of the names of the stages where the savings of the optimization are recorded (see printSavings)
+optimizePrefix = 'optimize '
+
+
+# number of pixels needed to show a length (in points) at the given resolution (dots per inch)
+def pixels(length, dpi):
+    return max(1, math.ceil(length * dpi / pointsPerInch))
+
+
+# JPEG images whose content can be used as it is in the PDF: baseline and gray or RGB (CMYK needs its colors inverted)
+def passThrough(info):
+    return info.format == 'JPEG' and info.baseline and info.mode in ('L', 'RGB')
+
+
+# resample an image to the pixel size that it will have in the PDF
+# info is the information about the image (probe.ImageInfo)
+# width and height are the size (in points) of the image on the page
+# the image is only reduced, never enlarged. Without dpi, it keeps its size
+# if a cache (ThumbnailCache) is given, images resampled in previous runs are not opened again
+# returns the prepared image (ImageData) or the path of the image if it is a JPEG that already has the right size
+# and can be embedded as it is (see drawImage)
+# content is the content of the file, if it has already been read
+# with optimize, the image is encoded to be as small as possible (see encodeImage), JPEG images included,
+# unless the original JPEG file is smaller
+def prepareImage(
+        imagePath, info, width, height, dpi, imageFormat=defaultImageFormat, quality=defaultQuality, cache=None,
+        content=None, optimize=False
+):
+    targetWidth = min(pixels(width, dpi), info.width) if dpi else info.width
+    targetHeight = min(pixels(height, dpi), info.height) if dpi else info.height
+
+    original = (targetWidth, targetHeight) == (info.width, info.height) and imageFormat == defaultImageFormat and \
+        passThrough(info)
+    if original and not optimize:
+        return imagePath
+
+    key = None
+    if cache:
+        key = cache.key(imagePath, (targetWidth, targetHeight), imageFormat, quality, optimize)
+        imageData = cache.get(key)
+        if imageData:
+            return imageData
+
+    with Image.open(imageSource(imagePath, content)) as image:
+        if (targetWidth, targetHeight) != image.size:
+            # JPEG images can be decoded directly at a reduced scale, which is much faster
+            image.draft('RGB', (targetWidth, targetHeight))
+            image = image.resize((targetWidth, targetHeight), Image.LANCZOS)
+
+        imageData = encodeImage(image, info.format, imageFormat, quality, optimize)
+
+    if original and len(imageData.content) >= (len(content) if content is not None else os.path.getsize(imagePath)):
+        # encoding it again does not make it smaller
+        return imagePath
+
+    if key:
+        cache.put(key, imageData)
+
+    return imageData
+
+
+# the image has transparency, which is lost if it is stored as JPEG
+def hasAlpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or 'transparency' in image.info
+
+
+# the image is a photograph: it has more than photoColors colors
+# PIL counts them in C, without converting the pixels to Python objects
+def isPhotographic(image):
+    return image.getcolors(photoColors) is None
+
+
+# the RGB image is really gray: the extrema of its chroma channels (Cb and Cr) are close to neutral (128)
+def isGray(image):
+    _, cb, cr = image.convert('YCbCr').getextrema()
+    return all(abs(extreme - 128) <= grayTolerance for extreme in cb + cr)
+
+
+# encode the pixels of an image in the format required by the PDF
+# JPEG images are stored as they are (DCTDecode), the others are compressed losslessly (FlateDecode)
+# with optimize, the images that are really gray are stored with one channel, the photographs without transparency
+# are stored as JPEG whatever their format, the JPEG tables are optimized, the compression is the highest one
+# and the content is binary (see binaryStreams)
+def encodeImage(image, sourceFormat, imageFormat=defaultImageFormat, quality=defaultQuality, optimize=False):
+    from reportlab import rl_config
+    from reportlab.lib.rl_accel import asciiBase85Encode
+
+    alpha = hasAlpha(image)
+    if image.mode in ('1', 'L'):
+        mode, colorSpace = 'L', 'DeviceGray'
+    else:
+        mode, colorSpace = 'RGB', 'DeviceRGB'
+
+    if image.mode != mode:
+        image = image.convert(mode)
+
+    if optimize and mode == 'RGB' and isGray(image):
+        image = image.convert('L')
+        colorSpace = 'DeviceGray'
+
+    photograph = sourceFormat == 'JPEG' or (optimize and not alpha and isPhotographic(image))
+    if imageFormat == 'JPEG' or (imageFormat == defaultImageFormat and photograph):
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=quality, optimize=optimize)
+        content = buffer.getvalue()
+        filters = ('DCTDecode',)
+    else:
+        content = zlib.compress(image.tobytes(), 9 if optimize else -1)
+        filters = ('FlateDecode',)
+
+    # the same name for the same pixels, so reportlab only embeds them once (the digest reportlab uses)
+    name = hashlib.md5(content, usedforsecurity=False).hexdigest()
+
+    if rl_config.useA85 and not optimize:
+        # follow the reportlab settings for the streams in the PDF
+        content = asciiBase85Encode(content).encode('latin-1')
+        filters = ('ASCII85Decode',) + filters
+
+    return ImageData(name, image.width, image.height, colorSpace, filters, content)
+
+
+# class of an image in the report of the optimization: its format, the format it is embedded in
+# and whether it has been reduced to gray
+# image is the prepared image (ImageData) or the path of a JPEG file embedded as it is
+def imageClass(info, image):
+    if not isinstance(image, ImageData):
+        return f'{info.format} kept'
+    target = 'JPEG' if 'DCTDecode' in image.filters else 'lossless'
+    gray = ' gray' if image.colorSpace == 'DeviceGray' and info.mode not in ('1', 'L') else ''
+    return f'{info.format} to {target}{gray}'
+
+
+# print the bytes saved by the optimization for each class of image (see imageClass)
+# the classes are recorded as stages whose name starts with optimizePrefix (see pipeline.prepareCell)
+def printSavings():
+    for name, (calls, _, read, written) in stats.stages.items():
+        if name.startswith(optimizePrefix) and read:
+            print(
+                f'{name[len(optimizePrefix):]}: {calls} image/s, {read} bytes in the original files and '
+                f'{written} bytes in the PDF ({100 * (read - written) / read:.0f}% saved)'
+            )
+
+
+# while it is active, the streams of the PDF (images and pages) are written in binary instead of ASCII85,
+# which makes them 20% smaller. reportlab only has a global setting for it
+@contextmanager
+def binaryStreams(enabled=True):
+    from reportlab import rl_config
+
+    useA85 = rl_config.useA85
+    if enabled:
+        rl_config.useA85 = 0
+    try:
+        yield
+    finally:
+        rl_config.useA85 = useA85
+
+
+# add a prepared image to the PDF and draw it in the rectangle (x, y, width, height)
+# this is what canvas.drawImage does, but without decoding and compressing the image again
+# returns the bytes added to the PDF, 0 if the image was already in it
+def embedImage(pdfCanvas, imageData, x, y, width, height):
+    from reportlab.pdfbase import pdfdoc
+
+    document = pdfCanvas._doc
+    regName = document.getXObjectName(imageData.name)
+    written = 0
+
+    if regName not in document.idToObject:
+        # first time the image is used, register it in the document
+        imageObject = pdfdoc.PDFImageXObject(imageData.name)
+        imageObject.width = imageData.width
+        imageObject.height = imageData.height
+        imageObject.bitsPerComponent = 8
+        imageObject.colorSpace = imageData.colorSpace
+        imageObject._filters = imageData.filters
+        imageObject.streamContent = imageData.content
+        imageObject.mask = None
+        pdfCanvas._setXObjects(imageObject)
+        document.Reference(imageObject, regName)
+        document.addForm(imageData.name, imageObject)
+        written = len(imageData.content)
+
+    pdfCanvas._currentPageHasImages = 1
+    pdfCanvas.saveState()
+    pdfCanvas.translate(x, y)
+    pdfCanvas.scale(width, height)
+    pdfCanvas._code.append(f'/{regName} Do')
+    pdfCanvas.restoreState()
+    pdfCanvas._formsinuse.append(imageData.name)
+
+    return written
+
+
+# add a JPEG file to the PDF without decoding it, its bytes are the content of the image (DCTDecode)
+# the file is memory mapped and only read again to be encoded the first time it is embedded
+# unless its content has already been read (fileContent)
+# returns the bytes read and the bytes added to the PDF
+def embedJPEG(pdfCanvas, imagePath, info, x, y, width, height, fileContent=None):
+    if fileContent is not None:
+        return 0, _embedJPEG(pdfCanvas, fileContent, info, x, y, width, height)
+
+    with open(imagePath, 'rb') as imageFile:
+        with mmap.mmap(imageFile.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            return len(content), _embedJPEG(pdfCanvas, content, info, x, y, width, height)
+
+
+# embed the content of a JPEG file (bytes or a memory mapped file), returns the bytes added to the PDF
+def _embedJPEG(pdfCanvas, content, info, x, y, width, height):
+    from reportlab import rl_config
+    from reportlab.lib.rl_accel import asciiBase85Encode
+
+    # the same name that reportlab gives to the JPEG files
+    name = hashlib.md5(content, usedforsecurity=False).hexdigest()
+    filters = ('DCTDecode',)
+
+    if pdfCanvas._doc.getXObjectName(name) in pdfCanvas._doc.idToObject:
+        content = None  # already in the PDF
+    elif rl_config.useA85:
+        content = asciiBase85Encode(content).encode('latin-1')
+        filters = ('ASCII85Decode',) + filters
+    else:
+        content = bytes(content)
+
+    colorSpace = 'DeviceGray' if info.mode == 'L' else 'DeviceRGB'
+    imageData = ImageData(name, info.width, info.height, colorSpace, filters, content)
+    return embedImage(pdfCanvas, imageData, x, y, width, height)
+
+
+# draw an image that can be a path or a prepared image (ImageData)
+# content is the content of the file of the image, if it has already been read
+# info is the information about the image (probe.ImageInfo), if it is already known
+# returns True if the image is a JPEG file embedded as it is, without decoding and compressing it again
+def drawImage(pdfCanvas, image, x, y, width, height, content=None, info=None):
+    with stats.measure('embed') as counters:
+        if isinstance(image, ImageData):
+            counters['written'] = embedImage(pdfCanvas, image, x, y, width, height)
+            return False
+
+        info = info or imageInfo(image, content)
+        if passThrough(info):
+            counters['read'], counters['written'] = embedJPEG(pdfCanvas, image, info, x, y, width, height, content)
+            return True
+
+        # reportlab reads and encodes the image, from its content if it has already been read
+        if content is not None:
+            from reportlab.lib.utils import ImageReader
+            image = ImageReader(BytesIO(content))
+        pdfCanvas.drawImage(image, x, y, width, height)
+        return False
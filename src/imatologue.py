@@ -8,25 +8,52 @@ paper formats, paper orientation, headers and footers, .....
 More information by running the script with the -h parameter and in the comments.
 '''
 
+import hashlib
 import os
 import os.path
-
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import Image
-from reportlab.lib.pagesizes import landscape
+import shutil
+import sys
+import tempfile
+from collections import deque
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
 
 from defaults import defaultFontName, defaultFontSize, newLine, textMargin, AUTHOR, CREATOR, headerFlag, now, \
-    nameSeparator, wordSeparator, imageFileExtensions, fieldSeparator, commentChar, defaultName, defaultExtension, \
-    unit, pages, dumpExtension
+    nameSeparator, wordSeparator, imageFileExtensions, defaultName, defaultExtension, \
+    unit, pages, dumpFormats, defaultImageFormat, defaultQuality, defaultJobs, \
+    defaultShardPages, megabyte, templateForm, bordersForm, standardOutput, statsExtension, defaultPrefetchMemory, \
+    landscape, planExtension, quarantineExtension, defaultCheckpointPages
 
 from cliparser import parseArgs
 from page import Page
+from images import prepareImage, drawImage, binaryStreams, printSavings
+from pipeline import prepareCells, imageHash
+from pdfmerge import PDFReader, PDFWriter
+from cache import openCache
+from probe import imageInfo
+from manifest import imageEntry, catalogLayout, loadManifest, saveManifest
+from scanner import scanImages
+from prefetch import prefetchImages
+from watcher import folderWatcher, waitForChanges
+from planner import planCatalog, savePlan
+from listfiles import readList, ListWriter
+from archives import isArchive, archiveImages
+from metadata import openStore
+from verifier import verifyImages, saveQuarantine
+from checkpoint import loadCheckpoint, newCheckpoint, addPart, partPath, checkpointFolder, removeCheckpoint
+import probe
+import stats
 
 
 # draws the image in the cell
+# cellData is a cell prepared by the pipeline: text, path, scaled size and image to embed
+# the border of the cell is drawn when the page is finished (see finishPage)
+# returns True if the image is a JPEG file embedded as it is (see images.drawImage)
+@stats.timed('draw')
 def drawCell(
         pdfCanvas, cellIndex, cellData, page,
-        cellBorder=True, cellTitle=True, fontName=defaultFontName, fontSize=defaultFontSize
+        cellTitle=True, fontName=defaultFontName, fontSize=defaultFontSize
 ):
 
     pdfCanvas.saveState()  # save the initial context
@@ -34,87 +61,107 @@ def drawCell(
     # font settings
     pdfCanvas.setFont(fontName, fontSize)
     
+    # geometry of the cell
+    cell = page.cells[cellIndex]
+
     # We move the origin of coordinates to coincide with the lower left corner of the cell
     # This is just a convenience to simplify the calculations
-    xOrigin, yOrigin = page.cellCoords(cellIndex)
-    pdfCanvas.translate(xOrigin, yOrigin)
+    pdfCanvas.translate(cell.x, cell.y)
     
     # width and height of the cell
-    width = page.cellWidth
-    height = page.cellHeight
+    width = cell.width
+    height = cell.height
 
     textHeight = fontSize  # height of the font
     textY = height - textHeight  # vertical position of the first line of text in the image
 
-    # internal cell dimensions without margins
-    internalWidth = page.cellInternalWidth
-    # using the smallest one to avoid overlapping, at least in the first line
-    internalHeight = min(page.cellInternalHeight, textY)
-
-    # cellData is a tuple
-    # first field is the header text of the image
-    # the second one is the path of the image
-    imageText, imagePath = cellData
-
-    # get the image size
-    with Image.open(imagePath) as image:
-        imageWidth, imageHeight = image.size
-
-    # scale the image while maintaining the aspect ratio to fit within the inner area of the cell
-    factor = min(internalWidth / imageWidth, internalHeight / imageHeight)  # factor de escalado
-    imageNewWidth = imageWidth * factor
-    imageNewHeight = imageHeight * factor
+    # the image has already been scaled to fit within the inner area of the cell
+    imageNewWidth = cellData.width
+    imageNewHeight = cellData.height
 
     # draws the scaled image inside the cell
     # centered horizontally and separated by the lower margin from the lower end of the cell
-    pdfCanvas.drawImage(
-        imagePath,
+    passThrough = drawImage(
+        pdfCanvas,
+        cellData.image,
         (width - imageNewWidth) // 2,
         page.cellBottom,
         imageNewWidth,
-        imageNewHeight
+        imageNewHeight,
+        content=cellData.content,
+        info=cellData.info
     )
 
-    # the borders and text are above the image to avoid being covered by the image
-    if cellBorder:
-        # draws a frame around the cell
-        pdfCanvas.rect(0, 0, width, height)
-
+    # the text is above the image to avoid being covered by the image
     if cellTitle:
         # put the image title on the top of the cell, horizontally centered
         halfWidth = width // 2
-        textData = imageText
+        textData = cellData.text
 
         # split the text in lines and write one below the other
         for line in textData.split(newLine):
             pdfCanvas.drawCentredString(halfWidth, textY, line)
             textY -= textHeight  # we lower the vertical position where the text will be written
 
-    print("Image added: {0}".format(imagePath))
     pdfCanvas.restoreState()  # restore the initial context
 
+    return passThrough
+
+
+# draws the borders of the first cells (as many as indicated by cells) of the current page
+def drawBorders(pdfCanvas, page, cells):
+    for cell in page.cells[:cells]:
+        pdfCanvas.rect(cell.x, cell.y, cell.width, cell.height)
+
+
+# creates the forms (reusable groups of drawing operations) shared by all the pages of the document
+# templateForm: the background image and the header
+# bordersForm: the borders of all the cells of the page
+# they are added to the PDF only once and each page just references them
+def createForms(
+        pdfCanvas, page, fontName, fontSize, header=None, background=None, x=0, y=0, width=0, height=0
+):
+    pdfCanvas.beginForm(templateForm)
+
+    # set the name and size of the font
+    pdfCanvas.setFont(fontName, fontSize)
+
+    if background:
+        # add the background image to the page
+        drawImage(pdfCanvas, background, x, y, width, height)
+
+    if header:
+        # set the page header
+        pdfCanvas.drawCentredString(page.pageWidth // 2, page.pageHeight - textMargin - fontSize, header)
+
+    pdfCanvas.endForm()
+
+    pdfCanvas.beginForm(bordersForm)
+    drawBorders(pdfCanvas, page, page.numCells)
+    pdfCanvas.endForm()
+
 
 # add a new page to the PDF document
 # the new page will be formatted as desired: page number, background, header,....
+# the background and the header are in the template form (see createForms)
 # the first page is not added only formatted
+# firstPage is the number of the first page of the document, greater than 1 when it is a part of the catalog
+@stats.timed('page')
 def addNewPage(
-        pdfCanvas, page, fontName, fontSize, pageNumber,
-        showPageNumber=None, header=None, timeStamp=None, background=None, x=0, y=0, width=0, height=0
+        pdfCanvas, page, fontName, fontSize, pageNumber, showPageNumber=None, timeStamp=None, firstPage=1
 ):
-    if pageNumber > 1:
+    if pageNumber > firstPage:
         # only need to add the second and succesives pages
         pdfCanvas.showPage()
 
+    pdfCanvas.doForm(templateForm)
+
     # set the name and size of the font
     pdfCanvas.setFont(fontName, fontSize)
 
     # horizontal center of the page
     center = page.pageWidth // 2
 
-    if background:
-        # add the background image to the page
-        pdfCanvas.drawImage(background, x, y, width, height)
-
     if timeStamp:
         # write date and time in the page footer
         pdfCanvas.drawString(page.pageLeft, textMargin, timeStamp)
@@ -123,15 +170,53 @@ def addNewPage(
         # write the page number in the footer page
         pdfCanvas.drawString(center, textMargin, str(pageNumber))
 
-    if header:
-        # set the page header
-        pdfCanvas.drawCentredString(center, page.pageHeight - textMargin - fontSize, header)
+
+# completes the current page, that contains numberOfCells images, drawing the borders of the cells
+# the borders are above the images to avoid being covered by them
+def finishPage(pdfCanvas, page, numberOfCells, withBorder):
+    if not withBorder:
+        return
+
+    if numberOfCells == page.numCells:
+        # full page
+        pdfCanvas.doForm(bordersForm)
+    else:
+        # last page of the document, only the cells with an image have a border
+        drawBorders(pdfCanvas, page, numberOfCells)
+
+
+# create an empty document
+def newCanvas(outputPDFName, page):
+    from reportlab.pdfgen import canvas  # not loaded when the catalog is only planned (see planner.py)
+
+    pdfCanvas = canvas.Canvas(outputPDFName, pagesize=page.size, pageCompression=1)
+
+    # set author and application name
+    pdfCanvas.setAuthor(AUTHOR)
+    pdfCanvas.setCreator(CREATOR)
+    pdfCanvas.setProducer(CREATOR)
+
+    return pdfCanvas
+
+
+# write the pages of a part of a streamed document (see createPDF) and release its memory
+def streamPart(pdfCanvas, writer):
+    with stats.measure('save') as counters:
+        start = writer.position
+        with PDFReader(pdfCanvas._filename, pdfCanvas.getpdfdata()) as reader:
+            writer.addPages(reader)
+            writer.release(reader)
+        counters['written'] = writer.position - start
 
 
 # create the catalog
+@stats.timed('pdf')
 def createPDF(
         images, outputPDFName, page, withBorder, withTitle, fontSize,
-        fontName=defaultFontName, background=None, expand=False, header=None, withDate=False, withNumberPages=False
+        fontName=defaultFontName, background=None, expand=False, header=None, withDate=False, withNumberPages=False,
+        dpi=None, imageFormat=defaultImageFormat, quality=defaultQuality, jobs=defaultJobs, readAhead=None,
+        firstPage=1, cache=None, deduplicate=False, streamPages=None, output=None,
+        prefetch=None, prefetchMemory=defaultPrefetchMemory, optimize=False
 ):
 
     # images: list of 2-uples
@@ -151,9 +236,40 @@ def createPDF(
 
     # expand: background image will fit page size
 
+    # dpi: resolution of the embedded images, they are resampled to the size of their cells
+    # if None, the original images are embedded
+
+    # imageFormat, quality: format and JPEG quality of the resampled images
+
+    # jobs: number of processes preparing the images (0: one per CPU)
+
+    # readAhead: maximum number of images being prepared in advance
+
+    # firstPage: number of the first page, when the document is a part of the catalog
+
+    # cache: persistent cache of the resampled images (ThumbnailCache), shared with other runs
+
+    # deduplicate: images with the same content are prepared and embedded only once
+
+    # streamPages: the document is created in parts of streamPages pages, each part is written as soon as
+    # it is complete and only one of them is in memory. If None, the whole document is written at the end
+    # output: binary file where the streamed document is written instead of outputPDFName (the standard output,...)
+
+    # prefetch: number of image files read in advance by a pool of threads, for storage with high latency
+    # prefetchMemory: bytes of the files read in advance that can be held at the same time
+
+    # optimize: all the images are encoded to be as small as possible (see images.encodeImage),
+    # the streams are binary when it is used with images.binaryStreams
+
+    # returns the number of pages and the number of images added to the PDF
+
+    # the time, calls and bytes of each stage are recorded (see stats.py)
+    # a line with the progress is printed from time to time
+
     cellIndex = 0  # index of the cell within the page
     numberOfimages = 0  # number of images added to the PDF
     numberOfpages = 0  # number of pages added to the PDF
+    passThroughImages = 0  # number of JPEG images embedded without decoding them
     newPage = 1  # a new page will be added if true
 
     # background image is optional
@@ -168,26 +284,44 @@ def createPDF(
     if background and not expand:
         # there is a background image and it won't fit the page size
         # get the size of the background image
-        bkImage = Image.open(background)
-        bkWidth, bkHeight = bkImage.size
-        bkImage.close()
+        bkWidth, bkHeight = imageInfo(background)[:2]
+
+    if background and (dpi or optimize):
+        # the background is also resampled, only once for all the pages
+        background = prepareImage(
+            background, imageInfo(background), bkWidth, bkHeight, dpi, imageFormat, quality, cache, optimize=optimize
+        )
 
     # set the y coordinate of the background
     bkY = page.pageHeight - bkHeight
 
-    # create the initial document
-    c = canvas.Canvas(outputPDFName, pagesize=page.size, pageCompression=1)
+    writer = None
+    if streamPages:
+        # the pages of each part are copied to the final document (pdfmerge.PDFWriter)
+        outputFile = output or open(outputPDFName, 'wb')
+        writer = PDFWriter(outputFile)
 
-    # set author and application name
-    c.setAuthor(AUTHOR)
-    c.setCreator(CREATOR)
-    c.setProducer(CREATOR) 
+    # create the initial document
+    c = newCanvas(outputPDFName, page)
+    partFirstPage = firstPage  # number of the first page of the current part
 
     headerText = header
 
-    for n, image in enumerate(images):
+    if prefetch:
+        # the files are read while the previous images are prepared and drawn (see prefetch.py)
+        images = prefetchImages(images, prefetch, prefetchMemory)
+
+    # images are read, resampled and compressed before being drawn, in a pool of processes if jobs > 1
+    # the time waiting for them is recorded as the prepare stage
+    cells = stats.timedIterator('prepare', prepareCells(
+        images, page, fontSize, dpi=dpi, imageFormat=imageFormat, quality=quality, jobs=jobs, readAhead=readAhead,
+        cache=cache, deduplicate=deduplicate, documentPages=streamPages, optimize=optimize
+    ))
+    progress = stats.Progress()
+
+    for n, image in enumerate(cells):
 
-        imageText, imagePath = image
+        imageText, imagePath = image[:2]
         if n == 0 and imageText == headerFlag:
             # the first line (only the first one) can be used in the page header
             # in this case it is not an image path but a text to be used as a page header
@@ -195,37 +329,306 @@ def createPDF(
             headerText = imagePath
             continue
 
+        # the stages of the preparation of the image, perhaps in another process
+        stats.merge(image.stages)
+
         # add a new page if necessary
         # we check this at the beginning because images is a generator and we don't know how many images it contains
-        # if we check this at the end, it is possible that images is empty and a blank page has been added unnecessarily
+        # if we check this at the end, it is possible that images is empty
+        # and a blank page has been added unnecessarily
         if newPage:
+            if numberOfpages:
+                # the previous page is full
+                finishPage(c, page, page.numCells, withBorder)
+
+                if writer and numberOfpages % streamPages == 0:
+                    # the part is complete, it is written and the next pages go to a new part
+                    streamPart(c, writer)
+                    c = newCanvas(outputPDFName, page)
+                    partFirstPage = firstPage + numberOfpages
+
+            if not c.hasForm(templateForm):
+                # the header is known when the first image arrives
+                # each part of a streamed document has its own forms
+                createForms(
+                    c, page, fontName, fontSize, header=headerText,
+                    background=background, x=bkX, y=bkY, width=bkWidth, height=bkHeight
+                )
+
             numberOfpages += 1
             addNewPage(
-                c, page, fontName, fontSize, numberOfpages,
+                c, page, fontName, fontSize, firstPage + numberOfpages - 1,
                 showPageNumber=withNumberPages,
                 timeStamp=now() if withDate else None,
-                background=background, x=bkX, y=bkY, width=bkWidth, height=bkHeight,
-                header=headerText
+                firstPage=partFirstPage
             )
 
         # draw the current cell
-        drawCell(
-            c, cellIndex, image, page,
-            cellBorder=withBorder, cellTitle=withTitle, fontSize=fontSize, fontName=fontName
+        passThroughImages += drawCell(
+            c, cellIndex, image, page, cellTitle=withTitle, fontSize=fontSize, fontName=fontName
         )
         # Increases the index of the cells inside the pages.
         # If the number of cells is exceeded create a new page
         # and resets the index
         newPage, cellIndex = divmod(cellIndex + 1, page.numCells)
         numberOfimages += 1
+        progress.update(numberOfimages, numberOfpages, imagePath)
+
+    progress.finish()
+
+    if numberOfpages:
+        # the last page can be full or not
+        finishPage(c, page, cellIndex or page.numCells, withBorder)
+
+    if passThroughImages:
+        print(f'{passThroughImages} JPEG image/s embedded as they are, without decoding them')
+
+    if writer:
+        # the last part and the structure of the document
+        streamPart(c, writer)
+        writer.close()
+        if not output:
+            outputFile.close()
+    else:
+        # save the PDF document
+        with stats.measure('save') as counters:
+            c.save()
+            counters['written'] = os.path.getsize(outputPDFName)
+
+    return numberOfpages, numberOfimages
+
+
+# the first line of an input file can be the page header (see createPDF)
+# when the images are split in several documents, it is resolved before splitting because it applies to all of them
+# returns the images without the header line and the header to be used
+def splitHeader(images, header=None):
+    images = iter(images)
+    first = next(images, None)
+    if first and first[0] == headerFlag:
+        return images, first[1]
+    if first:
+        return chain([first], images), header
+    return images, header
+
+
+# renders a shard of the catalog (a list of images filling whole pages) into its own PDF
+# it runs in a process of the pool created by createShardedPDF
+# returns the result of createPDF and the statistics of the shard, to be merged with those of the catalog
+def renderShard(images, partName, page, firstPage, options):
+    stats.reset()
+    with binaryStreams(options.get('optimize')):
+        return createPDF(images, partName, page, firstPage=firstPage, **options), stats.stages
+
+
+# create the catalog splitting the images in shards of shardPages pages
+# each shard is rendered into a partial PDF in its own process (shards processes)
+# the partial PDFs are merged, in order, into the final document as soon as they are finished
+# options are the keyword arguments of createPDF
+def createShardedPDF(images, outputPDFName, page, shards, shardPages=defaultShardPages, header=None, **options):
+
+    shardSize = shardPages * page.numCells  # images in each shard
+    images, header = splitHeader(images, header)
+
+    # each process prepares its own images
+    options.update(header=header, jobs=1)
+
+    # the partial PDFs are created in the same folder as the final one
+    partsFolder = tempfile.mkdtemp(prefix='.shards_', dir=os.path.dirname(os.path.realpath(outputPDFName)))
+    numberOfimages = 0
 
-    # save the PDF document
-    c.save()
+    try:
+        with ProcessPoolExecutor(shards, initializer=probe.useStore, initargs=(probe.metadataStore,)) as pool, \
+                open(outputPDFName, 'wb') as output:
+            writer = PDFWriter(output)
+            pending = deque()  # shards being rendered, in order
+
+            # wait for the oldest shard and copy its pages to the final document
+            def mergeShard():
+                future, partName = pending.popleft()
+                (_, shardImages), shardStats = future.result()
+                stats.merge(shardStats)
+                with stats.measure('merge') as counters, PDFReader(partName) as reader:
+                    start = writer.position
+                    writer.addPages(reader)
+                    writer.release(reader)
+                    counters['read'] = len(reader.data)
+                    counters['written'] = writer.position - start
+                os.remove(partName)
+                return shardImages
+
+            shardIndex = 0
+            shard = list(islice(images, shardSize))
+            while shard:
+                partName = os.path.join(partsFolder, f'part_{shardIndex:06d}.pdf')
+                # the page numbers continue those of the previous shards
+                firstPage = shardIndex * shardPages + 1
+                pending.append((pool.submit(renderShard, shard, partName, page, firstPage, options), partName))
+
+                if len(pending) >= 2 * shards:
+                    # limit the number of shards in memory and on disk
+                    numberOfimages += mergeShard()
+
+                shardIndex += 1
+                shard = list(islice(images, shardSize))
+
+            while pending:
+                numberOfimages += mergeShard()
+
+            writer.close()
+
+    finally:
+        shutil.rmtree(partsFolder, ignore_errors=True)
+
+    return writer.pageCount, numberOfimages
+
+
+# create the catalog in parts of checkpointPages pages, recording a checkpoint each time a part is finished
+# the partial PDFs and the number of images added to them are kept in a folder next to the PDF (see checkpoint.py)
+# with resume, a catalog that was interrupted (killed, out of memory,...) continues from its last checkpoint:
+# the images of the finished parts are skipped and the PDF is the same as if it had not been interrupted
+# source identifies the list of images, the checkpoint is only used with the same images and layout
+# the parts are merged into the final document when all of them are finished and the checkpoint is removed
+# options are the keyword arguments of createPDF
+def createCheckpointedPDF(
+        images, outputPDFName, page, checkpointPages=defaultCheckpointPages, resume=False, source=None, header=None,
+        **options
+):
 
-    # give some info to the user
-    print(
-        f'The PDF file has been created: {outputPDFName}. {numberOfpages} page/s containing {numberOfimages} image/s'
-    )
+    partSize = checkpointPages * page.numCells  # images in each part
+    images, header = splitHeader(images, header)
+    options['header'] = header
+    layout = catalogLayout(page, header, options)
+
+    state = loadCheckpoint(outputPDFName) if resume else None
+    if state is None:
+        if resume:
+            print(f'There is no checkpoint of {outputPDFName}, it is created from the beginning')
+        state = newCheckpoint(outputPDFName, layout, source)
+    else:
+        if state['layout'] != layout or state['source'] != source:
+            raise Exception(
+                f'The checkpoint of {outputPDFName} was recorded with other images or layout. Run without --resume'
+            )
+
+        # the images of the finished parts, the list must be the same up to the last one
+        last = None
+        for last in islice(images, state['images']):
+            pass
+        if state['images'] and (last is None or list(last[:2]) != state['last']):
+            raise Exception(
+                f'The images have changed since the checkpoint of {outputPDFName} was recorded. Run without --resume'
+            )
+        print(f"Resuming {outputPDFName}: {state['pages']} page/s containing {state['images']} image/s already added")
+
+    part = list(islice(images, partSize))
+    while part:
+        partName = f"part_{len(state['parts']):06d}.pdf"
+        # the page numbers continue those of the previous parts
+        numberOfpages, numberOfimages = createPDF(
+            part, partPath(outputPDFName, partName), page, firstPage=state['pages'] + 1, **options
+        )
+        addPart(outputPDFName, state, partName, numberOfpages, numberOfimages, part[-1][:2])
+        part = list(islice(images, partSize))
+
+    # the final document is written aside and replaces the previous one when it is complete
+    newName = os.path.join(checkpointFolder(outputPDFName), 'catalog.pdf')
+    with stats.measure('merge') as counters, open(newName, 'wb') as output:
+        writer = PDFWriter(output)
+        for partName in state['parts']:
+            with PDFReader(partPath(outputPDFName, partName)) as reader:
+                writer.addPages(reader)
+                writer.release(reader)
+                counters['read'] += len(reader.data)
+        writer.close()
+        counters['written'] = writer.position
+
+    os.replace(newName, outputPDFName)
+    removeCheckpoint(outputPDFName)
+
+    return writer.pageCount, state['images']
+
+
+# create the catalog reusing the pages of a previous version of it
+# the manifest of the previous version (see manifest.py) tells which images were in each page
+# only the pages whose images (or their text, path, modification time or size) have changed are created again,
+# the rest are copied from the previous PDF. If the layout has changed, all the pages are created.
+# a new manifest is written with the PDF
+# options are the keyword arguments of createPDF
+def createIncrementalPDF(images, outputPDFName, page, header=None, **options):
+
+    images, header = splitHeader(images, header)
+    options['header'] = header
+    layout = catalogLayout(page, header, options)
+
+    # images of each page
+    pages = []
+    for n, (imageText, imagePath) in enumerate(images):
+        if n % page.numCells == 0:
+            pages.append([])
+        pages[-1].append(imageEntry(imageText, imagePath))
+
+    previous = loadManifest(outputPDFName)
+    previousPages = previous['pages'] if previous and previous['layout'] == layout else []
+    changed = [
+        n for n, entries in enumerate(pages) if n >= len(previousPages) or previousPages[n] != entries
+    ]
+    numberOfimages = sum(len(entries) for entries in pages)
+
+    if not changed and len(pages) == len(previousPages):
+        print(f'{outputPDFName} is up to date')
+        return len(pages), numberOfimages
+
+    if len(changed) == len(pages):
+        # nothing can be reused
+        createPDF([entry[:2] for entries in pages for entry in entries], outputPDFName, page, **options)
+        saveManifest(outputPDFName, layout, pages)
+        return len(pages), numberOfimages
+
+    # consecutive changed pages are created together in a partial PDF: [first page, last page + 1]
+    runs = []
+    for n in changed:
+        if runs and runs[-1][1] == n:
+            runs[-1][1] = n + 1
+        else:
+            runs.append([n, n + 1])
+
+    folder = os.path.dirname(os.path.realpath(outputPDFName))
+    partsFolder = tempfile.mkdtemp(prefix='.incremental_', dir=folder)
+    newName = os.path.join(partsFolder, 'catalog.pdf')
+
+    try:
+        parts = {}  # page -> (partial PDF, index of the page in it)
+        for first, last in runs:
+            partName = os.path.join(partsFolder, f'part_{first:06d}.pdf')
+            runImages = [entry[:2] for entries in pages[first:last] for entry in entries]
+            createPDF(runImages, partName, page, firstPage=first + 1, **options)
+            for n in range(first, last):
+                parts[n] = partName, n - first
+
+        # the new document is written aside and replaces the previous one when it is complete
+        readers = {outputPDFName: PDFReader(outputPDFName)}
+        try:
+            with stats.measure('merge') as counters, open(newName, 'wb') as output:
+                writer = PDFWriter(output)
+                for n in range(len(pages)):
+                    fileName, index = parts.get(n, (outputPDFName, n))
+                    if fileName not in readers:
+                        readers[fileName] = PDFReader(fileName)
+                    writer.addPages(readers[fileName], [index])
+                writer.close()
+                counters['written'] = writer.position
+        finally:
+            for reader in readers.values():
+                reader.close()
+
+        os.replace(newName, outputPDFName)
+        saveManifest(outputPDFName, layout, pages)
+
+    finally:
+        shutil.rmtree(partsFolder, ignore_errors=True)
+
+    print(f'{len(changed)} page/s created, {len(pages) - len(changed)} page/s reused from the previous catalog')
+    return len(pages), numberOfimages
 
 
 # each image has a text associated with it that can be used as the title of the image
@@ -240,12 +643,11 @@ def imageTitle(imageFileName):
 
 
 # check if an image can be included in the catalog
-def validImage(im, excludePattern=None):
-
-    if not os.path.isfile(im):
-        # path is not a file, omit
-        return False
+# without checkFile, the path is not checked to be a file (the members of an archive, see archives.py)
+@stats.timed('validate')
+def validImage(im, excludePattern=None, checkFile=True):
 
+    # the checks that don't access the file system go first
     _, extension = os.path.splitext(im)
 
     if extension not in imageFileExtensions:
@@ -256,44 +658,41 @@ def validImage(im, excludePattern=None):
         # file contains the exclusion pattern, omit
         return False
 
+    if checkFile and not os.path.isfile(im):
+        # path is not a file, omit
+        return False
+
     # image is valid, will be added to the catalog
     return True
 
 
-# create an iterator using a text file as input.
-# each line of the file will consist of one or more fields, separated by ;
-# the first field is mandatory and is the path to the image file 
-# the other fields are strings that are considered to be information relative to the image and will be displayed in the catalog
-# at the top of the image, each field as a line of text
-# lines starting with # are ignored
-def imagesFromFile(f, separator=fieldSeparator):
-    with open(f) as imagesList:
-        for line in imagesList:
-            # lines starting with # are ignored
-            if line.startswith(commentChar):
-                continue
-            components = line.strip().split(separator)
-            # first field is the image path
-            image = components.pop(0)
-            # all other fields are returned as a string, replacing each ; by \n
-            imageText = newLine.join(components) if components else None
-            yield imageText, image
-
-
-def dump(dumpFile, iterator):
-    # dumpFile is a text file where we will dump the PDF images and the text associated with them
+def dump(dumpFile, iterator, dumpFormat='text', withHash=False):
+    # dumpFile is a list file where we will dump the PDF images and the text associated with them (see listfiles.py)
     # dumpFile could be used as an input file to generate the same PDF
+    # in the jsonl and csv formats, the size, format and bytes of the images are written too, so that they are not
+    # probed again when the file is used as input (only the headers of the images are read to dump them)
+    # with withHash, their content hash is also written (the files are read if it is not known)
     try:
         with open(dumpFile, 'w') as dumpStore:
-            for imageText, image in iterator:
-                yield imageText, image
+            writer = ListWriter(dumpStore, dumpFormat)
+            for item in iterator:
+                yield item
+                # the images of an archive come with their content (see archives.py)
+                imageText, image = item[:2]
+                content = item[2] if len(item) > 2 else None
                 if imageText == headerFlag:
                     # the image is not a path, but a text to be used as a page header
                     # write the text without any other fields
-                    dumpStore.write(image + newLine)
+                    writer.header(image)
+                elif dumpFormat == 'text':
+                    writer.image(image, imageText)
                 else:
-                    fields = [image] + imageText.split(newLine)
-                    dumpStore.write(fieldSeparator.join(fields) + newLine)
+                    size, digest = probe.knownInfo(image, probe.knownFiles) or (None, None)
+                    if size is None:
+                        size = os.path.getsize(image) if content is None else len(content)
+                    if withHash and not digest:
+                        digest = imageHash(image) if content is None else hashlib.sha1(content).digest()
+                    writer.image(image, imageText, imageInfo(image, content), size, digest)
 
         print(f'{dumpFile} has been created, containing the list of images and associated data')
 
@@ -305,28 +704,30 @@ def dump(dumpFile, iterator):
 
 
 # builds an iterator that generates the list of images to be used in the catalog
-def imagesIterator(f, recursive=False, excludePattern=None):
+@stats.timed('scan')
+def imagesIterator(f, recursive=False, excludePattern=None, jobs=1):
     try:
-        isDir = os.path.isdir(f)
-
-        if isDir and recursive:
-            # if f is a directory and the recursive flag is active
-            # a generator will be created with all the files contained in f and its subdirectories
-            iterator = (
-                (None, os.path.join(path, fileName))
-                for path, folders, files in os.walk(f) for fileName in sorted(files)
-            )
-        elif isDir:
-            # if f is a directory and the recursive flag is not active
-            # a generator is created with all the files contained in f
-            iterator = (
-                (None, os.path.join(f, fileName))
-                for fileName in sorted(os.listdir(f))
-            )
-        elif os.path.isfile(f):
+        if os.path.isdir(f):
+            # if f is a directory, the images contained in it
+            # (and in its subdirectories if the recursive flag is active)
+            # the scanner only returns files with an allowed extension that don't contain the exclusion pattern
+            # the name of the image file will be used as the text associated with the image
+            for image in scanImages(f, recursive, excludePattern):
+                yield imageTitle(image), image
+            return
+
+        if isArchive(f):
+            # if f is a ZIP or TAR file, the images inside it as if it were a folder, with their content
+            # they are filtered by their names, the rest of the members are never read
+            for image, content in archiveImages(f, recursive, lambda path: validImage(path, excludePattern, False)):
+                yield imageTitle(image), image, content
+            return
+
+        if os.path.isfile(f):
             # f is a file
-            # f is a text file where each line contains the path to a file and data (text) related to it.
-            iterator = imagesFromFile(f)
+            # f is a list file where each line contains the path to a file and data (text) related to it.
+            # (fields separated by ;, JSON lines or CSV, see listfiles.py), parsed by jobs processes if it is large
+            iterator = readList(f, jobs)
         else:
             # error: f is neither a file nor a directory
             raise Exception(f'{f} is neither a file nor a folder')
@@ -342,12 +743,12 @@ def imagesIterator(f, recursive=False, excludePattern=None):
                 # headerFlag will be a flag to indicate that the image value should be used in the header
                 imageText = headerFlag
             elif not validImage(image, excludePattern):
-                # the previous iterators provide a list of files
+                # the input file can contain any path
                 # here we filter to keep only the ones we're interested in, ignoring the rest
                 print(f'The file {image} is not an allowed image. Omitted')
                 continue
             elif not imageText:
-                # if f is a directory or no text has been supplied for the image
+                # if no text has been supplied for the image
                 # the name of the image file will be used as the text associated with the image
                 imageText = imageTitle(image)
 
@@ -361,36 +762,53 @@ def imagesIterator(f, recursive=False, excludePattern=None):
 
 
 def main():
-    
-    from pprint import pprint
 
-    print(os.getcwd())
-    
     args = parseArgs()
 
-    f = args.fileOrFolder
-    if not(os.path.isfile(f) or os.path.isdir(f)):
-        raise Exception(f'{f} is neither a file nor a folder')
+    if args.plan:
+        createPlan(args)
+    elif args.outputFileName == standardOutput:
+        # the PDF is streamed to the standard output, the messages go to the standard error
+        output = sys.stdout.buffer
+        with redirect_stdout(sys.stderr):
+            createCatalog(args, output)
+    elif args.watch:
+        watchCatalog(args)
+    else:
+        createCatalog(args)
 
-    if not args.outputFileName:
-        # the name of the output file has not been specified
-        # if f is a file, the same file will be used as path and output name changing the extension to PDF
-        # if f is a directory, the directory will be used as path and filename will be the directory name with PDF extension
-        fullPath = os.path.realpath(f)
-        path = os.path.dirname(fullPath)
-        basename = os.path.basename(fullPath)
-        name, _ = os.path.splitext(basename)
-        args.outputFileName = os.path.join(path, name + nameSeparator + defaultName + defaultExtension)
 
-    if args.background and not os.path.isfile(args.background):
-        raise Exception(f'The background parameter is not a file: {args.background}')
+# create the catalog and update it each time its images change, until the program is interrupted
+# only the pages from the first changed image onwards are created again (see createIncrementalPDF)
+def watchCatalog(args):
 
-    pprint(args)
+    args.incremental = True
+    probe.revalidate = True  # the images can change between two updates
+
+    watcher = folderWatcher(args.fileOrFolder, args.recursive, args.exclude)
+    print(f'Watching {args.fileOrFolder} with {type(watcher).__name__}. Press Ctrl+C to stop')
+    try:
+        createCatalog(args)
+        while True:
+            waitForChanges(watcher, args.watchDelay)
+            stats.reset()
+            try:
+                createCatalog(args)
+            except Exception as e:
+                # an image may be incomplete, the catalog is updated again with the next change
+                print(f'The catalog could not be updated: {e}')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+# the page (Page) described by the command line arguments
+def pageLayout(args):
 
     pageWidth, pageHeight = pages[args.page] if not args.landscape else landscape(pages[args.page])
 
-    # information about the page and cells
-    pageFormat = Page(
+    return Page(
         pageWidth,
         pageHeight,
         cells=(args.columns, args.rows),
@@ -398,30 +816,153 @@ def main():
         cellMargins=(
             args.internalMargin*unit, args.internalMargin*unit, args.internalMargin*unit, args.internalMargin*unit
         ),
-        gap=(args.gapHorizontal*unit, args.gapVertical*unit)
+        gap=(args.gapHorizontal*unit, args.gapVertical*unit),
+        spans={(col - 1, row - 1): (columns, rows) for col, row, columns, rows in args.span or []}
+    )
+
+
+# the name of the PDF when it is not given: the name of the file or folder of images with a suffix, next to it
+def defaultOutput(fileOrFolder):
+    fullPath = os.path.realpath(fileOrFolder)
+    path = os.path.dirname(fullPath)
+    basename = os.path.basename(fullPath)
+    name, _ = os.path.splitext(basename)
+    return os.path.join(path, name + nameSeparator + defaultName + defaultExtension)
+
+
+# the file where the plan of a catalog is written: next to the PDF, with the same name and a different extension
+def planName(args):
+    return os.path.splitext(args.outputFileName or defaultOutput(args.fileOrFolder))[0] + planExtension
+
+
+# plan the catalog described by the command line arguments without creating it (see planner.py)
+# the plan is written next to the PDF, with the same name and a different extension, or to the standard output (-o -)
+def createPlan(args):
+
+    # the metadata of the images stored by previous runs (see metadata.py)
+    probe.useStore(openStore(args.metadata) if args.metadata else None)
+
+    images = imagesIterator(args.fileOrFolder, args.recursive, excludePattern=args.exclude, jobs=args.jobs)
+    plan = planCatalog(
+        images, pageLayout(args), args.fontSize, args.header, args.dpi, args.imageFormat, args.optimize
     )
+    if probe.metadataStore is not None:
+        probe.metadataStore.flush()
+
+    if args.outputFileName == standardOutput:
+        savePlan(plan, sys.stdout)
+        return plan
+
+    planFile = planName(args)
+    savePlan(plan, planFile)
+    print(
+        f"{plan['pages']} page/s containing {plan['images']} image/s, "
+        f"estimated size of the PDF: {plan['estimatedBytes'] / megabyte:.1f} MB"
+    )
+    for imagePath in plan['unreadable']:
+        print(f'The image {imagePath} can not be read')
+    print(f'{planFile} has been created, containing the page and cell of each image')
+    return plan
+
+
+# verify the images of the catalog (--verify) and return the valid ones, without stopping at the damaged ones
+# the damaged images are written to quarantineFile, with the error found in each one
+def verifyCatalog(args, images, quarantineFile):
+    valid, quarantined = verifyImages(images, decode=args.verify == 'decode', jobs=args.jobs)
+    if quarantined:
+        for imagePath, error in quarantined:
+            print(f'The image {imagePath} is damaged ({error}). Omitted')
+        saveQuarantine(quarantineFile, quarantined, len(valid) + len(quarantined))
+        print(f'{quarantineFile} has been created, containing the {len(quarantined)} damaged image/s')
+    else:
+        print(f'{len(valid)} image/s verified, none of them is damaged')
+
+    if isArchive(args.fileOrFolder):
+        # the content of the images of an archive is not kept while they are verified, it is read again
+        damaged = {imagePath for imagePath, _ in quarantined}
+        images = imagesIterator(args.fileOrFolder, args.recursive, excludePattern=args.exclude, jobs=args.jobs)
+        return (item for item in images if item[1] not in damaged)
+    return iter(valid)
+
+
+# create the catalog described by the command line arguments
+# output is the binary file where the PDF is streamed, if it is not written to args.outputFileName
+# memoryCache is the cache of resampled images kept by a long-running process (cache.MemoryCache), if any
+# returns the number of pages and the number of images added to the PDF
+def createCatalog(args, output=None, memoryCache=None):
+
+    from pprint import pprint
+
+    if output and (args.shards or args.incremental):
+        raise Exception('The PDF can only be streamed without --shards or --incremental')
+
+    if (args.checkpoint or args.resume) and (output or args.shards or args.incremental):
+        # the parts of the catalog are kept next to the PDF, they are merged into it at the end
+        raise Exception('Checkpoints can only be used without --shards, --incremental, --watch or -o -')
+
+    print(os.getcwd())
+
+    f = args.fileOrFolder
+    if not(os.path.isfile(f) or os.path.isdir(f)):
+        raise Exception(f'{f} is neither a file nor a folder')
+
+    if args.incremental and isArchive(f):
+        # the pages that change are created again from the paths of their images, they can't be opened in an archive
+        raise Exception('The images of an archive can only be used without --incremental or --watch')
+
+    # if f is a file, the same file will be used as path and output name changing the extension to PDF
+    # if f is a directory, the directory will be used as path
+    # and filename will be the directory name with PDF extension
+    defaultOutputName = defaultOutput(f)
+
+    if not args.outputFileName:
+        # the name of the output file has not been specified
+        args.outputFileName = defaultOutputName
+
+    if args.background and not os.path.isfile(args.background):
+        raise Exception(f'The background parameter is not a file: {args.background}')
+
+    pprint(args)
+
+    # information about the page and cells
+    pageFormat = pageLayout(args)
 
     dumpFile = None
 
-    if args.dump:
-        # will dump the image information (path and text) to a text file
-        # will use the same path and name as for the output file changing the extension to .txt
-        basename, extension = os.path.splitext(args.outputFileName)
-        dumpFile = basename + dumpExtension
+    dumpFormat = args.dumpFormat or 'text'
+    if args.dump or args.dumpFormat:
+        # will dump the image information (path and text) to a list file
+        # will use the same path and name as for the output file changing the extension to the one of its format
+        basename, extension = os.path.splitext(defaultOutputName if output else args.outputFileName)
+        dumpFile = basename + dumpFormats[dumpFormat]
         if os.path.isfile(args.fileOrFolder) and dumpFile == args.fileOrFolder:
             # if the name of the input file matches the dump file name
             # we put a suffix in the name of the latter so that they do not coincide
-            dumpFile = basename + nameSeparator + dumpExtension
+            dumpFile = basename + nameSeparator + dumpFormats[dumpFormat]
+
+    # the metadata of the images stored by previous runs (see metadata.py)
+    probe.useStore(openStore(args.metadata) if args.metadata else None)
 
     # create the images generator
-    imagesList = imagesIterator(args.fileOrFolder, args.recursive, excludePattern=args.exclude)
+    imagesList = imagesIterator(args.fileOrFolder, args.recursive, excludePattern=args.exclude, jobs=args.jobs)
 
-    # all the necessary information has been collected
-    # create the PDF
-    createPDF(
-        dump(dumpFile, imagesList) if dumpFile else imagesList,
-        args.outputFileName,
-        pageFormat,
+    if args.verify:
+        # the damaged images are left out before the catalog is created (see verifier.py)
+        # they are listed in a report next to the PDF, with the same name and a different extension
+        basename = os.path.splitext(defaultOutputName if output else args.outputFileName)[0]
+        imagesList = verifyCatalog(args, imagesList, basename + quarantineExtension)
+
+    if dumpFile:
+        imagesList = dump(dumpFile, imagesList, dumpFormat, withHash=args.dedup)
+
+    cache = openCache(args.cache, args.cacheSize * megabyte) if args.cache else None
+    if memoryCache is not None:
+        # the images resampled by previous catalogs are kept in memory, in front of the persistent cache
+        memoryCache.store = cache
+        cache = memoryCache
+
+    # options of the PDF
+    options = dict(
         withBorder=args.border,
         withTitle=args.text,
         fontSize=args.fontSize,
@@ -429,9 +970,62 @@ def main():
         expand=args.expand,
         withDate=args.date,
         withNumberPages=args.numberPages,
-        header=args.header
+        header=args.header,
+        dpi=args.dpi,
+        imageFormat=args.imageFormat,
+        quality=args.quality,
+        cache=cache,
+        deduplicate=args.dedup,
+        prefetch=args.prefetch,
+        prefetchMemory=args.prefetchMemory * megabyte,
+        optimize=args.optimize
     )
 
+    # all the necessary information has been collected
+    # create the PDF
+    with binaryStreams(args.optimize):
+        if args.incremental:
+            numberOfpages, numberOfimages = createIncrementalPDF(
+                imagesList, args.outputFileName, pageFormat, jobs=args.jobs, readAhead=args.readAhead, **options
+            )
+        elif args.checkpoint or args.resume:
+            numberOfpages, numberOfimages = createCheckpointedPDF(
+                imagesList, args.outputFileName, pageFormat, args.checkpointPages, args.resume,
+                source=os.path.realpath(args.fileOrFolder), jobs=args.jobs, readAhead=args.readAhead,
+                streamPages=args.streamPages if args.stream else None, **options
+            )
+        elif args.shards:
+            numberOfpages, numberOfimages = createShardedPDF(
+                imagesList, args.outputFileName, pageFormat, args.shards, shardPages=args.shardPages, **options
+            )
+        else:
+            numberOfpages, numberOfimages = createPDF(
+                imagesList, args.outputFileName, pageFormat, jobs=args.jobs, readAhead=args.readAhead,
+                streamPages=args.streamPages if args.stream or output else None, output=output, **options
+            )
+
+    if probe.metadataStore is not None:
+        # the metadata of the images probed by this process, for the next runs
+        probe.metadataStore.flush()
+
+    # give some info to the user
+    print(
+        f'The PDF file has been created: {args.outputFileName}. '
+        f'{numberOfpages} page/s containing {numberOfimages} image/s'
+    )
+
+    if args.optimize:
+        printSavings()
+
+    if args.stats:
+        # the statistics are written next to the PDF, with the same name and a different extension
+        statsFile = os.path.splitext(defaultOutputName if output else args.outputFileName)[0] + statsExtension
+        stats.printStats()
+        stats.saveStats(statsFile, pages=numberOfpages, images=numberOfimages, arguments=vars(args))
+        print(f'{statsFile} has been created, containing the statistics of each stage')
+
+    return numberOfpages, numberOfimages
+
 if __name__ == "__main__":
 
     main()
@@ -0,0 +1,226 @@
+'''List files of images: fields separated by ;, JSON lines and CSV, with the metadata of the images if known'''
+
+import csv
+import gc
+import json
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from defaults import fieldSeparator, commentChar, newLine, listFormats, csvColumns, listChunkSize, \
+    listParallelSize
+from probe import ImageInfo, knownImages, knownFiles
+
+
+# format of a list file, by its extension: text (fields separated by ;), jsonl or csv
+def listFormat(fileName):
+    return listFormats.get(os.path.splitext(fileName)[1].lower(), 'text')
+
+
+# information about an image (probe.ImageInfo) and size and hash of its file given by an entry of a list file
+# entry is a dictionary with the fields of the entry, the missing ones are None or ''
+# the image information needs the size, format and color mode, the hash needs the size of the file
+def entryMetadata(entry):
+    try:
+        info = ImageInfo(
+            int(entry['width']), int(entry['height']), entry['format'], entry['mode'],
+            entry.get('baseline') in (True, 1, '1', 'true', 'True')
+        )
+        if not (info.width and info.height and info.format and info.mode):
+            info = None
+    except (KeyError, TypeError, ValueError):
+        info = None
+    try:
+        fileData = int(entry['bytes']), bytes.fromhex(entry['hash'])
+        if not fileData[1]:
+            fileData = None
+    except (KeyError, TypeError, ValueError):
+        fileData = None
+    return info, fileData
+
+
+# the parsers of the lines of a chunk of a list file return the entries (text, path) and the metadata of the images
+# of those that have it (path, info, fileData), see entryMetadata
+
+# text file: each line is a list of fields separated by ;, the first one is the path of the image
+# and the rest are the lines of its text
+def parseText(lines, separator=fieldSeparator):
+    entries = []
+    for line in lines:
+        if line.startswith(commentChar):
+            continue
+        components = line.strip().split(separator)
+        image = components.pop(0)
+        entries.append(((newLine.join(components) if components else None), image))
+    return entries, []
+
+
+# JSON lines: each line is an object with the path of the image and, optionally, its text (a string or a list of
+# lines) and metadata (see entryMetadata). An object with only a header is the header of the pages
+# the lines are parsed together, as a JSON array: it is much faster than parsing each one
+def parseJSONL(lines):
+    entries, metadata = [], []
+    lines = [line for line in lines if line.strip() and not line.startswith(commentChar)]
+    objects = json.loads('[' + ','.join(lines) + ']')
+    for entry in objects:
+        if 'path' not in entry:
+            # as the first line of a text file, see imatologue.imagesIterator
+            entries.append((None, entry['header']))
+            continue
+        text = entry.get('text')
+        if isinstance(text, list):
+            text = newLine.join(text)
+        entries.append(((text or None), entry['path']))
+        info, fileData = entryMetadata(entry)
+        if info or fileData:
+            metadata.append((entry['path'], info, fileData))
+    return entries, metadata
+
+
+# CSV: the columns are named by the first line of the file (see csvColumns), the lines of the text are separated by ;
+# a line with only a path and no other fields can be the header of the pages, as in a text file
+# the fields can't contain line breaks, each line is an entry
+def parseCSV(lines, columns):
+    entries, metadata = [], []
+    for row in csv.reader(line for line in lines if not line.startswith(commentChar)):
+        if not row:
+            continue
+        entry = dict(zip(columns, row))
+        text = entry.get('text')
+        entries.append(((text.replace(fieldSeparator, newLine) if text else None), entry['path']))
+        info, fileData = entryMetadata(entry)
+        if info or fileData:
+            metadata.append((entry['path'], info, fileData))
+    return entries, metadata
+
+
+# entries and metadata of the lines between the offsets start and end of a list file
+# it runs in the process that reads the file or in a pool of processes: the file is mapped in memory by each one,
+# only the offsets of the chunk are sent and the parsed entries returned
+def parseChunk(fileName, listType, start, end, columns=None):
+    with open(fileName, 'rb') as listFile, mmap.mmap(listFile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        lines = mapped[start:end].decode('utf-8-sig').splitlines()
+
+    # the entries have no reference cycles: the garbage collector would only slow down the parsing
+    # (it examines all the objects again and again while millions of them are created)
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        if listType == 'jsonl':
+            return parseJSONL(lines)
+        if listType == 'csv':
+            return parseCSV(lines, columns)
+        return parseText(lines)
+    finally:
+        if collecting:
+            gc.enable()
+
+
+# offsets (start, end) of the chunks of a file mapped in memory, each one ends at the end of a line
+def chunkOffsets(mapped, start, chunkSize):
+    offsets = []
+    size = len(mapped)
+    while start < size:
+        end = mapped.find(b'\n', min(start + chunkSize, size) - 1)
+        end = size if end < 0 else end + 1
+        offsets.append((start, end))
+        start = end
+    return offsets
+
+
+# generator of the images of a list file: (text, path)
+# the text is None if the line has no text, the header of the pages is returned as a path without text
+# the information about the images (size, format,...) and the size and hash of their files, if the file contains them,
+# are stored in probe.knownImages and probe.knownFiles, so that the images are not probed or hashed again
+# the file is mapped in memory and parsed in chunks, by a pool of jobs processes when it is larger than parallelSize
+def readList(fileName, jobs=1, chunkSize=listChunkSize, parallelSize=listParallelSize):
+    listType = listFormat(fileName)
+    if os.path.getsize(fileName) == 0:
+        return
+
+    with open(fileName, 'rb') as listFile, mmap.mmap(listFile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        start = columns = None
+        if listType == 'csv':
+            # the first line names the columns
+            start = mapped.find(b'\n') + 1 or len(mapped)
+            columns = next(csv.reader([mapped[:start].decode('utf-8-sig')]), csvColumns)
+            columns = [column.strip().lower() for column in columns]
+            if 'path' not in columns:
+                raise Exception(f'The CSV file {fileName} has no path column')
+        offsets = chunkOffsets(mapped, start or 0, chunkSize)
+        size = len(mapped)
+
+    jobs = jobs or os.cpu_count()
+    if jobs == 1 or len(offsets) <= 1 or size < parallelSize:
+        chunks = (parseChunk(fileName, listType, *offset, columns) for offset in offsets)
+        yield from _entries(chunks)
+        return
+
+    with ProcessPoolExecutor(jobs) as pool:
+        # a chunk being parsed for each process, in order, so the parsed entries waiting don't fill the memory
+        def chunks():
+            window = deque()
+            for offset in offsets:
+                window.append(pool.submit(parseChunk, fileName, listType, *offset, columns))
+                if len(window) >= jobs:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+
+        yield from _entries(chunks())
+
+
+# the entries of the parsed chunks, storing their metadata
+def _entries(chunks):
+    for entries, metadata in chunks:
+        for image, info, fileData in metadata:
+            if info:
+                knownImages[image] = info
+            if fileData:
+                knownFiles[image] = fileData
+        yield from entries
+
+
+# writes the images of a catalog to a list file that can be used to create it again
+# with metadata (JSON lines and CSV) the size, format and color mode of the images and the size of their files are
+# written too, and their content hash (sha1 digest) when it is known
+class ListWriter:
+
+    def __init__(self, listFile, listType='text'):
+        self.listFile = listFile
+        self.listType = listType
+        self.csv = None
+        if listType == 'csv':
+            self.csv = csv.writer(listFile, lineterminator=newLine)
+            self.csv.writerow(csvColumns)
+
+    # the header of the pages
+    def header(self, text):
+        if self.listType == 'jsonl':
+            self.listFile.write(json.dumps({'header': text}) + newLine)
+        elif self.csv:
+            self.csv.writerow([text])
+        else:
+            self.listFile.write(text + newLine)
+
+    # an image, with info (probe.ImageInfo), size and hash of its file if they are known
+    def image(self, path, text, info=None, size=None, digest=None):
+        lines = text.split(newLine) if text else []
+        if self.listType == 'text':
+            self.listFile.write(fieldSeparator.join([path] + lines) + newLine)
+            return
+
+        entry = dict(path=path, text=fieldSeparator.join(lines) if self.csv else lines)
+        if info:
+            entry.update(width=info.width, height=info.height, format=info.format, mode=info.mode)
+            entry.update(baseline=int(info.baseline) if self.csv else info.baseline)
+        if size is not None:
+            entry['bytes'] = size
+        if digest:
+            entry['hash'] = digest.hex()
+
+        if self.csv:
+            self.csv.writerow([entry.get(column, '') for column in csvColumns])
+        else:
+            self.listFile.write(json.dumps(entry) + newLine)
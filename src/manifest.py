@@ -0,0 +1,59 @@
+'''Manifest of a catalog: the layout used to create it and the images of each page'''
+
+import json
+import os
+import tempfile
+
+from defaults import manifestExtension
+from archives import fileStamp
+
+
+# the manifest is stored next to the PDF, with the same name and a different extension
+def manifestName(pdfName):
+    return os.path.splitext(pdfName)[0] + manifestExtension
+
+
+# entry of an image in the manifest: its text, path, modification time and size
+# if any of them changes, the page containing the image has to be created again
+def imageEntry(imageText, imagePath):
+    return [imageText, imagePath, *fileStamp(imagePath)]
+
+
+# the layout of the catalog: everything, apart from the images, that changes the content of the pages
+# page is the format of the pages (Page) and options the keyword arguments of createPDF
+def catalogLayout(
+        page, header, options,
+        ignored=('cache', 'jobs', 'readAhead', 'deduplicate', 'prefetch', 'prefetchMemory', 'streamPages')
+):
+    layout = {key: value for key, value in options.items() if key not in ignored}
+    layout['header'] = header
+    layout['page'] = page.arguments[:-1]  # the arguments used to create the page, except the spans
+    layout['spans'] = sorted([*position, *span] for position, span in page.spans.items())
+
+    background = options.get('background')
+    if background:
+        layout['background'] = imageEntry(None, background)
+
+    # the manifest is stored as JSON: tuples become lists
+    return json.loads(json.dumps(layout))
+
+
+# the manifest of a PDF: {'layout': catalogLayout, 'pages': list of pages, each one a list of imageEntry}
+# returns None if the PDF or its manifest does not exist or can't be read
+def loadManifest(pdfName):
+    if not os.path.isfile(pdfName):
+        return None
+    try:
+        with open(manifestName(pdfName)) as manifestFile:
+            return json.load(manifestFile)
+    except (OSError, ValueError):
+        return None
+
+
+# write the manifest of a PDF, replacing the previous one only when it is complete
+def saveManifest(pdfName, layout, pages):
+    fileName = manifestName(pdfName)
+    handle, temporaryName = tempfile.mkstemp(dir=os.path.dirname(os.path.realpath(fileName)), prefix='.')
+    with os.fdopen(handle, 'w') as manifestFile:
+        json.dump({'layout': layout, 'pages': pages}, manifestFile)
+    os.replace(temporaryName, fileName)
@@ -0,0 +1,233 @@
+'''
+Store of the metadata of the images (size, format, color mode and content hash) shared by all the runs.
+It is a SQLite database: its rows are keyed by the path of the image and are only used while the modification time
+and size of the file are the same, so the images that have not changed are not opened to probe or hash them again.
+Several processes (the pool of -j, --shards, batch.py and server.py) can read and write it at the same time.
+Run as a script, it removes the rows of the images that have been deleted or changed since they were stored.
+More information by running the script with the -h parameter.
+'''
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.util import Finalize
+
+from defaults import metadataTimeout, metadataBatch, scanThreads
+from probe import ImageInfo
+from archives import fileStamp
+
+schema = '''
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    modified INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    format TEXT,
+    mode TEXT,
+    baseline INTEGER,
+    hash BLOB
+)
+'''
+
+# the information and the hash of an image are stored separately, when they are known
+# the other one is kept while the file has not changed
+putInfo = '''
+INSERT INTO images (path, modified, size, width, height, format, mode, baseline) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (path) DO UPDATE SET
+    hash = CASE WHEN modified = excluded.modified AND size = excluded.size THEN hash END,
+    modified = excluded.modified, size = excluded.size, width = excluded.width, height = excluded.height,
+    format = excluded.format, mode = excluded.mode, baseline = excluded.baseline
+'''
+putHash = '''
+INSERT INTO images (path, modified, size, hash) VALUES (?, ?, ?, ?)
+ON CONFLICT (path) DO UPDATE SET
+    width = CASE WHEN modified = excluded.modified AND size = excluded.size THEN width END,
+    height = CASE WHEN modified = excluded.modified AND size = excluded.size THEN height END,
+    format = CASE WHEN modified = excluded.modified AND size = excluded.size THEN format END,
+    mode = CASE WHEN modified = excluded.modified AND size = excluded.size THEN mode END,
+    baseline = CASE WHEN modified = excluded.modified AND size = excluded.size THEN baseline END,
+    modified = excluded.modified, size = excluded.size, hash = excluded.hash
+'''
+
+
+# The store of a database file
+# Each thread of each process has its own connection, opened when it is first used
+# (SQLite connections can't be shared by threads or inherited by forked processes)
+# The rows are written in transactions of metadataBatch rows, the rest when the store is flushed:
+# when the catalog is finished or the process of a pool ends
+# The database uses a write-ahead log, so the readers don't wait for the writers,
+# and the writers wait for each other up to metadataTimeout seconds
+class MetadataStore:
+
+    def __init__(self, fileName, timeout=metadataTimeout, batch=metadataBatch):
+        self.fileName = fileName
+        self.timeout = timeout
+        self.batch = batch
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.pending = []  # rows not written yet: (statement, parameters)
+        self.pid = os.getpid()
+
+        with self._connection() as connection:
+            connection.execute(schema)
+        # the rows not written yet are written when the process ends (also the processes of a pool)
+        Finalize(self, self.flush, exitpriority=10)
+
+    # stores are sent to other processes by the name of their file
+    def __reduce__(self):
+        return MetadataStore, (self.fileName, self.timeout, self.batch)
+
+    def _connection(self):
+        if self.pid != os.getpid():
+            # a forked process: the connections and rows of the parent are not its own
+            self.local = threading.local()
+            self.pending = []
+            self.pid = os.getpid()
+            Finalize(self, self.flush, exitpriority=10)
+
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.fileName, timeout=self.timeout)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    # the row of an image if its file has not changed: (ImageInfo or None, hash or None)
+    # stamp is the modification time and size of its file (see archives.fileStamp)
+    def _get(self, path, stamp):
+        row = self._connection().execute(
+            'SELECT width, height, format, mode, baseline, hash FROM images '
+            'WHERE path = ? AND modified = ? AND size = ?',
+            (path, *stamp)
+        ).fetchone()
+        if row is None:
+            return None, None
+        width, height, imageFormat, mode, baseline, digest = row
+        info = ImageInfo(width, height, imageFormat, mode, bool(baseline)) if imageFormat else None
+        return info, digest
+
+    # information about an image (probe.ImageInfo) or None if it is not known
+    def info(self, path, stamp):
+        return self._get(path, stamp)[0]
+
+    # content hash (sha1 digest) of an image or None if it is not known
+    def digest(self, path, stamp):
+        return self._get(path, stamp)[1]
+
+    def putInfo(self, path, stamp, info):
+        self._put(putInfo, (path, *stamp, info.width, info.height, info.format, info.mode, int(info.baseline)))
+
+    def putDigest(self, path, stamp, digest):
+        self._put(putHash, (path, *stamp, digest))
+
+    def _put(self, statement, parameters):
+        with self.lock:
+            self._connection()
+            self.pending.append((statement, parameters))
+            if len(self.pending) < self.batch:
+                return
+        self.flush()
+
+    # write the rows not written yet
+    def flush(self):
+        with self.lock:
+            connection = self._connection()
+            rows, self.pending = self.pending, []
+            if not rows:
+                return
+            with connection:
+                for statement, parameters in rows:
+                    connection.execute(statement, parameters)
+
+
+# the stores opened by the process, by file name (a server creates many catalogs with the same store)
+stores = {}
+
+
+# the store of a database file, created if it doesn't exist
+def openStore(fileName):
+    fileName = os.path.realpath(fileName)
+    if fileName not in stores:
+        stores[fileName] = MetadataStore(fileName)
+    return stores[fileName]
+
+
+# remove the rows of the images that no longer exist or whose modification time or size has changed
+# the files are checked by a pool of threads, in chunks of rows
+# returns the number of rows checked and removed
+def prune(fileName, threads=scanThreads, chunk=10000):
+    store = MetadataStore(fileName)
+    connection = store._connection()
+
+    # the rows are read in order of path, a chunk after the previous one
+    checked = removed = 0
+    last = ''
+    with ThreadPoolExecutor(threads) as pool:
+        while True:
+            rows = connection.execute(
+                'SELECT path, modified, size FROM images WHERE path > ? ORDER BY path LIMIT ?', (last, chunk)
+            ).fetchall()
+            if not rows:
+                break
+            last = rows[-1][0]
+
+            stale = [
+                path for (path, modified, size), stamp in zip(rows, pool.map(_stamp, (row[0] for row in rows)))
+                if stamp != (modified, size)
+            ]
+            with connection:
+                connection.executemany('DELETE FROM images WHERE path = ?', ((path,) for path in stale))
+            checked += len(rows)
+            removed += len(stale)
+
+    return checked, removed
+
+
+# modification time and size of a file or None if it doesn't exist
+def _stamp(path):
+    try:
+        return fileStamp(path)
+    except OSError:
+        return None
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Remove the rows of the images that have been deleted or changed from a store of metadata '
+                    '(see imatologue --metadata).'
+    )
+    parser.add_argument('database', help='SQLite file of the store')
+    parser.add_argument(
+        '--vacuum', action='store_true', help='Rebuild the file after pruning it, to return the free space'
+    )
+    parser.add_argument('--threads', type=int, default=scanThreads, help='Threads checking the files')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    if not os.path.isfile(args.database):
+        raise Exception(f'{args.database} is not a file')
+
+    start = time.perf_counter()
+    checked, removed = prune(args.database, args.threads)
+    print(f'{removed} of {checked} row/s removed in {time.perf_counter() - start:.2f} s')
+
+    if args.vacuum:
+        connection = sqlite3.connect(args.database, timeout=metadataTimeout)
+        connection.execute('VACUUM')
+        connection.close()
+        print(f'{args.database} has been rebuilt')
+
+    return 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
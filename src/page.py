@@ -1,13 +1,32 @@
+from collections import namedtuple
+
 from defaults import defaultPageMargin, defaultMargin, defaultGap, defaultCols, defaultRows
 
 
+# geometry of a cell of the page
+# col, row: position of the upper left corner of the cell in the grid of the page
+# x, y: origin of the cell (lower left corner) in the reportlab coordinate system
+# width, height: size of the cell including its margins
+# internalWidth, internalHeight: size of the cell without its margins
+CellBox = namedtuple('CellBox', 'col row x y width height internalWidth internalHeight')
+
+
 # Rectangular page (width, height) made up of a matrix of cells (N columns x M rows)
 # The page has four margins: left, right, top, and bottom
-# Each cell represents an image 
+# Each cell represents an image
 # Cells can have their own internal margins
 # There can be horizontal and vertical spaces between cells (gap)
+# A cell can span several columns and rows of the matrix (spans), for example to highlight an image
+# The page is immutable: all the measures and the geometry of every cell are calculated when it is created
 class Page:
 
+    __slots__ = (
+        'pageWidth', 'pageHeight', 'horizontalGap', 'verticalGap', 'cols', 'rows',
+        'pageLeft', 'pageRight', 'pageTop', 'pageBottom', 'cellLeft', 'cellRight', 'cellTop', 'cellBottom',
+        'spans', 'size', 'internalWidth', 'effectiveWidth', 'cellWidth', 'cellInternalWidth',
+        'internalHeight', 'effectiveHeight', 'cellHeight', 'cellInternalHeight', 'cells', 'numCells', '_grid'
+    )
+
     def __init__(
         self,
         width,  # page width
@@ -15,94 +34,146 @@ class Page:
         # page margins: left, right, top, down
         margins=(defaultPageMargin, defaultPageMargin, defaultPageMargin, defaultPageMargin),
         # horizontal and vertical spacing between cells
-        gap=(defaultGap, defaultGap),  
+        gap=(defaultGap, defaultGap),
         # number of horizontal and vertical cells
-        cells=(defaultCols, defaultRows),  
+        cells=(defaultCols, defaultRows),
         # cell margins
-        cellMargins=(defaultMargin, defaultMargin, defaultMargin, defaultMargin)  
+        cellMargins=(defaultMargin, defaultMargin, defaultMargin, defaultMargin),
+        # cells spanning several columns and rows: {(col, row): (columns, rows)}
+        spans=None
     ):
-        self.pageWidth = width
-        self.pageHeight = height
-        self.horizontalGap, self.verticalGap = gap
-        self.cols, self.rows = cells
-        self.pageLeft, self.pageRight, self.pageTop, self.pageBottom = margins
-        self.cellLeft, self.cellRight, self.cellTop, self.cellBottom = cellMargins
-
-    # page size
-    @property
-    def size(self):
-        return self.pageWidth, self.pageHeight
+        define = super().__setattr__
 
-    # cells per page
-    @property
-    def numCells(self):
-        return self.rows * self.cols
+        define('pageWidth', width)
+        define('pageHeight', height)
+        define('horizontalGap', gap[0])
+        define('verticalGap', gap[1])
+        define('cols', cells[0])
+        define('rows', cells[1])
+        define('pageLeft', margins[0])
+        define('pageRight', margins[1])
+        define('pageTop', margins[2])
+        define('pageBottom', margins[3])
+        define('cellLeft', cellMargins[0])
+        define('cellRight', cellMargins[1])
+        define('cellTop', cellMargins[2])
+        define('cellBottom', cellMargins[3])
+        define('spans', dict(spans or {}))
 
-    # page width without horizontal margins
-    @property
-    def internalWidth(self):
-        return self.pageWidth - (self.pageLeft + self.pageRight)
+        # page size
+        define('size', (width, height))
 
-    # page width without horizontal margins and horizontal spacing between cells
-    @property
-    def effectiveWidth(self):
-        return self.internalWidth - (self.horizontalGap * (self.cols - 1))
+        # page width without horizontal margins
+        define('internalWidth', self.pageWidth - (self.pageLeft + self.pageRight))
+        # page width without horizontal margins and horizontal spacing between cells
+        define('effectiveWidth', self.internalWidth - (self.horizontalGap * (self.cols - 1)))
+        # cell width including its horizontal margins
+        define('cellWidth', self.effectiveWidth // self.cols)
+        # cell width without its horizontal margins
+        define('cellInternalWidth', self.cellWidth - (self.cellLeft + self.cellRight))
 
-    # cell width including its horizontal margins
-    @property
-    def cellWidth(self):
-        return self.effectiveWidth // self.cols
+        # page height without vertical margins
+        define('internalHeight', self.pageHeight - (self.pageTop + self.pageBottom))
+        # page height without vertical margins and vertical spacing between cells
+        define('effectiveHeight', self.internalHeight - (self.verticalGap * (self.rows - 1)))
+        # cell height including its vertical margins
+        define('cellHeight', self.effectiveHeight // self.rows)
+        # cell height without its vertical margins
+        define('cellInternalHeight', self.cellHeight - (self.cellTop + self.cellBottom))
 
-    # cell width without its horizontal margins
-    @property
-    def cellInternalWidth(self):
-        return self.cellWidth - (self.cellLeft + self.cellRight)
+        cellsTable, grid = self._layout()
+        # geometry of the cells, in the order they are filled
+        define('cells', cellsTable)
+        # cells per page
+        define('numCells', len(cellsTable))
+        # index of the cell that occupies each position (col, row) of the matrix
+        define('_grid', grid)
 
-    # page height without vertical margins
-    @property
-    def internalHeight(self):
-        return self.pageHeight - (self.pageTop + self.pageBottom)
+    def __setattr__(self, name, value):
+        raise AttributeError('Page is immutable')
 
-    # page height without vertical margins and vertical spacing between cells
-    @property
-    def effectiveHeight(self):
-        return self.internalHeight - (self.verticalGap * (self.rows - 1))
+    def __delattr__(self, name):
+        raise AttributeError('Page is immutable')
 
-    # cell height including its vertical margins
+    # arguments of the constructor that creates an identical page
     @property
-    def cellHeight(self):
-        return self.effectiveHeight // self.rows
+    def arguments(self):
+        return (
+            self.pageWidth, self.pageHeight,
+            (self.pageLeft, self.pageRight, self.pageTop, self.pageBottom),
+            (self.horizontalGap, self.verticalGap),
+            (self.cols, self.rows),
+            (self.cellLeft, self.cellRight, self.cellTop, self.cellBottom),
+            self.spans
+        )
 
-    # cell height without its vertical margins
-    @property
-    def cellInternalHeight(self):
-        return self.cellHeight - (self.cellTop + self.cellBottom)
+    # pages are rebuilt from the arguments of their constructor (to be sent to other processes)
+    def __reduce__(self):
+        return Page, self.arguments
 
-    # each page has N cells (N = ROWS x COLUMNS)
-    # we assign an index to each cell
+    # calculates the geometry of all the cells
+    # each page has N cells, we assign an index to each cell
     # 0 is the index of the upper left corner cell
     # N-1 is the index of the lower right corner cell
+    # a cell spanning several positions of the matrix takes the index of its upper left position,
+    # the rest of the positions it covers have no cell of their own
+    def _layout(self):
+        cells = []
+        grid = [[None] * self.cols for _ in range(self.rows)]
+
+        for row in range(self.rows):
+            for col in range(self.cols):
+                if grid[row][col] is not None:
+                    # covered by a previous cell, it can't be the origin of a span
+                    if (col, row) in self.spans:
+                        raise Exception(f'The cell ({col + 1}, {row + 1}) overlaps other cells')
+                    continue
+
+                colSpan, rowSpan = self.spans.get((col, row), (1, 1))
+                if col + colSpan > self.cols or row + rowSpan > self.rows:
+                    raise Exception(f'The cell ({col + 1}, {row + 1}) exceeds the page')
+
+                index = len(cells)
+                for spanRow in range(row, row + rowSpan):
+                    for spanCol in range(col, col + colSpan):
+                        if grid[spanRow][spanCol] is not None:
+                            raise Exception(f'The cell ({col + 1}, {row + 1}) overlaps other cells')
+                        grid[spanRow][spanCol] = index
+
+                # reportlab places the origin of coordinates (0,0) in the lower left corner of the sheet
+                # we calculate the origin of the lower left corner of the cell inside the sheet
+                # note that the cells with lower indexes are placed at the top of the sheet
+                # we reverse the direction of the vertical indexes to adjust it to the reportlab coordinate system
+                # the horizontal coordinates work naturally (from left to right).
+                invertedRow = self.rows - (row + rowSpan)
+                width = self.cellWidth * colSpan + self.horizontalGap * (colSpan - 1)
+                height = self.cellHeight * rowSpan + self.verticalGap * (rowSpan - 1)
+                cells.append(CellBox(
+                    col,
+                    row,
+                    self.pageLeft + (self.cellWidth + self.horizontalGap) * col,
+                    self.pageBottom + (self.cellHeight + self.verticalGap) * invertedRow,
+                    width,
+                    height,
+                    width - (self.cellLeft + self.cellRight),
+                    height - (self.cellTop + self.cellBottom)
+                ))
+
+        return tuple(cells), grid
+
+    # position (col, row) of the cell with the given index
     def cellPosition(self, index):
-        row, col = divmod(index, self.cols)
-        return col, row
-
-    # calculates the origin of the graphical coordinates of the cell on the sheet
-    # reportlab places the origin of coordinates (0,0) in the lower left corner of the sheet
-    # we calculate the origin of the lower left corner of the cell inside the sheet
-    # note that the cells with lower indexes are placed at the top of the sheet
-    # and those with higher indexes at the bottom of the sheet.
-    # This implies that the cells with lower indexes have vertical coordinates greater than those with lower indexes
-    # the horizontal coordinates work naturally (from left to right).
+        cell = self.cells[index]
+        return cell.col, cell.row
+
+    # origin of the graphical coordinates of the cell on the sheet (lower left corner)
+    # cell is the index of the cell or its position in the matrix (col, row)
     def cellCoords(self, cell):
         try:
             col, row = cell  # cell is a tuple indicating the postition of the cell: (col, row)
+            cell = self._grid[row][col]
         except TypeError:
-            col, row = self.cellPosition(cell)  # cell is the index of the cell, an integer
-        except Exception as e:
-            raise e
-        
-        xOrigin = self.pageLeft + (self.cellWidth + self.horizontalGap) * col
-        # we reverse the direction of the vertical indexes to adjust it to the reportlab coordinate system
-        invertedRow = (self.numCells - 1) // self.cols - row
-        yOrigin = self.pageBottom + (self.cellHeight + self.verticalGap) * invertedRow
-        return xOrigin, yOrigin
+            pass  # cell is the index of the cell, an integer
+
+        cell = self.cells[cell]
+        return cell.x, cell.y
@@ -0,0 +1,306 @@
+'''Concatenation of the PDF documents created by this application'''
+
+import hashlib
+import mmap
+import re
+
+# Only the documents written by reportlab (and by this module) are supported:
+# a classic cross-reference table, without object streams or incremental updates.
+# The pages are copied together with the objects they use (contents, fonts, images, forms)
+# and each object is written as soon as it is read, so the memory used does not depend on the size of the documents.
+# The objects without references (images, fonts, contents) that are identical in several documents are written once.
+
+# object numbers reserved in the merged document
+PAGES, CATALOG, INFO = 1, 2, 3
+
+# indirect reference (N G R) or a literal string, that must be left unchanged
+_reference = re.compile(rb'\((?:\\.|[^\\)])*\)|(?<![\w./])(\d+)\s+(\d+)\s+R(?!\w)', re.S)
+_objectHeader = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj\s*')
+_streamStart = re.compile(rb'\s*stream\r?\n')
+_integer = re.compile(rb'\s*(\d+)\s*')
+
+
+# references to other objects in the dictionary part of an object
+def references(data):
+    return [int(match.group(1)) for match in _reference.finditer(data) if match.group(1)]
+
+
+# replace the references to other objects using the new numbers in mapping
+def renumber(data, mapping):
+    def replace(match):
+        if not match.group(1):
+            return match.group(0)  # it is a string
+        return b'%d 0 R' % mapping[int(match.group(1))]
+    return _reference.sub(replace, data)
+
+
+# value of an entry of a dictionary, as bytes: a name, a number or a reference
+def dictValue(data, key):
+    match = re.search(rb'/' + key + rb'(?![\w.])\s*((?:\d+\s+\d+\s+R)|/?[\w.+-]+)', data)
+    return match.group(1) if match else None
+
+
+# position of sub in data (bytes or mmap) after start
+def find(data, sub, start):
+    position = data.find(sub, start)
+    if position < 0:
+        raise Exception(f'Invalid PDF document, {sub} not found')
+    return position
+
+
+# position of the end of the dictionary that starts at position start
+# strings are skipped, they can contain any character
+def dictEnd(data, start):
+    depth = 0
+    position = start
+    while True:
+        char = data[position:position + 1]
+        if not char:
+            raise Exception('Unterminated dictionary in PDF object')
+        if data[position:position + 2] == b'<<':
+            depth += 1
+            position += 2
+        elif data[position:position + 2] == b'>>':
+            depth -= 1
+            position += 2
+            if depth == 0:
+                return position
+        elif char == b'(':
+            # literal string, with balanced parentheses and escaped characters
+            level = 0
+            while True:
+                char = data[position:position + 1]
+                if char == b'\\':
+                    position += 1
+                elif char == b'(':
+                    level += 1
+                elif char == b')':
+                    level -= 1
+                    if level == 0:
+                        break
+                position += 1
+            position += 1
+        elif char == b'<':
+            # hexadecimal string
+            position = find(data, b'>', position) + 1
+        else:
+            position += 1
+
+
+# a PDF document opened for reading
+# the file is memory mapped, objects are read only when they are needed
+# data is the content of the document when it is already in memory, fileName is then only used in the messages
+class PDFReader:
+
+    def __init__(self, fileName, data=None):
+        self.fileName = fileName
+        if data is None:
+            with open(fileName, 'rb') as pdfFile:
+                data = mmap.mmap(pdfFile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = data
+        self.offsets, self.trailer = self._crossReference()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # read the cross-reference table: the offset of each object in the file and the trailer dictionary
+    def _crossReference(self):
+        data = self.data
+        start = data.rfind(b'startxref')
+        if start < 0:
+            raise Exception(f'{self.fileName} is not a valid PDF document')
+        position = int(_integer.match(data, start + len(b'startxref')).group(1))
+
+        if data[position:position + 4] != b'xref':
+            raise Exception(f'{self.fileName}: cross-reference streams are not supported')
+
+        trailerStart = find(data, b'trailer', position)
+        tokens = data[position + len(b'xref'):trailerStart].split()
+        offsets = {}
+        index = 0
+        while index < len(tokens):
+            # each subsection: number of the first object, number of objects and an entry per object
+            first, count = int(tokens[index]), int(tokens[index + 1])
+            index += 2
+            for number in range(first, first + count):
+                offset, _, kind = tokens[index:index + 3]
+                if kind == b'n':
+                    offsets[number] = int(offset)
+                index += 3
+
+        trailerStart = find(data, b'<<', trailerStart)
+        trailer = data[trailerStart:dictEnd(data, trailerStart)]
+        if dictValue(trailer, b'Prev'):
+            raise Exception(f'{self.fileName}: incremental updates are not supported')
+        return offsets, trailer
+
+    # read an object: its dictionary (or value) and its stream, if any
+    def object(self, number):
+        data = self.data
+        header = _objectHeader.match(data, self.offsets[number])
+        start = header.end()
+
+        if data[start:start + 2] != b'<<':
+            # not a dictionary: a number, an array,...
+            return data[start:find(data, b'endobj', start)].rstrip(), None
+
+        end = dictEnd(data, start)
+        dictionary = data[start:end]
+        stream = _streamStart.match(data, end)
+        if not stream:
+            return dictionary, None
+
+        length = dictValue(dictionary, b'Length')
+        if length.endswith(b'R'):
+            # the length is stored in another object
+            length = self.object(int(length.split()[0]))[0]
+        return dictionary, data[stream.end():stream.end() + int(length)]
+
+    # number of the object referenced by the entry key of a dictionary
+    def reference(self, dictionary, key):
+        value = dictValue(dictionary, key)
+        return int(value.split()[0]) if value and value.endswith(b'R') else None
+
+    @property
+    def info(self):
+        return self.reference(self.trailer, b'Info')
+
+    # numbers of the nodes of the page tree and of the pages, in the order of the document
+    def pageTree(self):
+        nodes, pages = [], []
+        catalog = self.object(self.reference(self.trailer, b'Root'))[0]
+        pending = [self.reference(catalog, b'Pages')]
+        while pending:
+            number = pending.pop()
+            dictionary = self.object(number)[0]
+            if re.search(rb'/Type\s*/Pages(?!\w)', dictionary):
+                nodes.append(number)
+                kids = re.search(rb'/Kids\s*\[([^\]]*)\]', dictionary).group(1)
+                pending.extend(reversed(references(kids)))
+            else:
+                pages.append(number)
+        return nodes, pages
+
+    @property
+    def pages(self):
+        return self.pageTree()[1]
+
+
+# a PDF document written sequentially to a binary file object (a file, stdout,...)
+# pages of other documents are appended with addPages, the document is completed with close
+class PDFWriter:
+
+    def __init__(self, output):
+        self.output = output
+        self.position = 0
+        self.offsets = {}
+        self.nextNumber = INFO + 1
+        self.pageNumbers = []  # numbers of the page objects, in order
+        self.mappings = {}  # for each reader, its pages and the new numbers of its objects (old number -> new number)
+        self.leaves = {}  # hash of an object without references -> its number
+        self.info = None
+        self._write(b'%PDF-1.4\n%\x93\x8c\x8b\x9e\n')
+
+    def _write(self, data):
+        self.output.write(data)
+        self.position += len(data)
+
+    def _newNumber(self):
+        number = self.nextNumber
+        self.nextNumber += 1
+        return number
+
+    def _writeObject(self, number, dictionary, stream=None):
+        self.offsets[number] = self.position
+        self._write(b'%d 0 obj\n' % number)
+        self._write(dictionary)
+        if stream is not None:
+            self._write(b'\nstream\n')
+            self._write(stream)
+            self._write(b'\nendstream')
+        self._write(b'\nendobj\n')
+
+    @property
+    def pageCount(self):
+        return len(self.pageNumbers)
+
+    # append pages of a document (PDFReader), all of them if indexes is None
+    # indexes are positions of the pages in the document, starting at 0
+    # the objects shared by the pages of the same document are only copied once
+    def addPages(self, reader, indexes=None):
+        if reader not in self.mappings:
+            nodes, pages = reader.pageTree()
+            # the pages of all documents hang from the same page tree
+            self.mappings[reader] = pages, dict.fromkeys(nodes, PAGES)
+            if self.info is None and reader.info:
+                self.info = reader.object(reader.info)[0]
+
+        pages, mapping = self.mappings[reader]
+        for index in (range(len(pages)) if indexes is None else indexes):
+            self.pageNumbers.append(self._copy(reader, pages[index], mapping))
+
+    # no more pages of the document (PDFReader) will be added, the numbers of its objects are not needed
+    def release(self, reader):
+        self.mappings.pop(reader, None)
+
+    # copy an object and all the objects referenced by it that have not been copied yet
+    def _copy(self, reader, number, mapping):
+        if number in mapping:
+            return mapping[number]
+
+        mapping[number] = self._newNumber()
+        pending = [number]
+        while pending:
+            old = pending.pop()
+            dictionary, stream = reader.object(old)
+            for reference in references(dictionary):
+                if reference not in mapping:
+                    if not self._copyLeaf(reader, reference, mapping):
+                        mapping[reference] = self._newNumber()
+                        pending.append(reference)
+            self._writeObject(mapping[old], renumber(dictionary, mapping), stream)
+
+        return mapping[number]
+
+    # copy an object without references, unless an identical one has already been written
+    # returns False if the object has references
+    def _copyLeaf(self, reader, number, mapping):
+        dictionary, stream = reader.object(number)
+        if references(dictionary):
+            return False
+
+        digest = hashlib.sha1(dictionary)
+        if stream is not None:
+            digest.update(b'stream')
+            digest.update(stream)
+        digest = digest.digest()
+
+        if digest not in self.leaves:
+            self.leaves[digest] = self._newNumber()
+            self._writeObject(self.leaves[digest], dictionary, stream)
+        mapping[number] = self.leaves[digest]
+        return True
+
+    # write the page tree, the catalog, the document information and the cross-reference table
+    def close(self):
+        kids = b' '.join(b'%d 0 R' % number for number in self.pageNumbers)
+        self._writeObject(PAGES, b'<< /Type /Pages /Count %d /Kids [ %s ] >>' % (self.pageCount, kids))
+        self._writeObject(CATALOG, b'<< /Type /Catalog /Pages %d 0 R /PageMode /UseNone >>' % PAGES)
+        self._writeObject(INFO, self.info or b'<< >>')
+
+        xrefPosition = self.position
+        self._write(b'xref\n0 %d\n0000000000 65535 f \n' % self.nextNumber)
+        for number in range(1, self.nextNumber):
+            self._write(b'%010d 00000 n \n' % self.offsets[number])
+        self._write(
+            b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (self.nextNumber, CATALOG, INFO, xrefPosition)
+        )
+        self.output.flush()
@@ -0,0 +1,259 @@
+'''Preparation of the cells of the catalogue, optionally in a pool of processes'''
+
+import hashlib
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+
+from defaults import headerFlag, defaultImageFormat, defaultQuality, readAheadPerJob, hashBlockSize
+from images import ImageData, prepareImage, imageClass, optimizePrefix
+from probe import imageInfo, knownInfo, knownFiles, useStore
+from archives import fileStamp
+import probe
+import stats
+
+
+# a cell ready to be drawn in the PDF
+# text: text associated with the image
+# path: path of the source image
+# width, height: size (in points) of the image inside the cell
+# image: what will be embedded in the PDF, the path of the image or a prepared image (ImageData)
+# seconds: time spent preparing the image
+# stages: statistics of the preparation, recorded in the process that prepared it (see stats.merge)
+# content: content of the file of the image, read in advance (see prefetch.py), when it is embedded as it is
+# info: information about the source image (probe.ImageInfo), so that it is not probed again when it is embedded
+Cell = namedtuple('Cell', 'text path width height image seconds stages content info')
+
+
+# size of an image scaled to fit within the inner area of a cell (page.CellBox) while maintaining its aspect ratio
+def fitImage(imageSize, cell, fontSize):
+    imageWidth, imageHeight = imageSize
+
+    # internal cell dimensions without margins
+    internalWidth = cell.internalWidth
+    # using the smallest one to avoid overlapping with the first line of text
+    internalHeight = min(cell.internalHeight, cell.height - fontSize)
+
+    factor = min(internalWidth / imageWidth, internalHeight / imageHeight)  # scale factor
+    return imageWidth * factor, imageHeight * factor
+
+
+# read the size of an image and, if a resolution is given, resample it for its cell (page.CellBox)
+# cellData is a tuple: the text of the image, its path and, optionally, the content of its file (see prefetch.py)
+# cache is the persistent cache of resampled images (ThumbnailCache), if any
+# with optimize, every image is prepared to be as small as possible (see images.encodeImage)
+# and its size before and after is recorded in a stage for its class (see images.printSavings)
+# info is the information about the image, when it is already known (see probe.knownInfo)
+def prepareCell(
+        cellData, cell, fontSize, dpi=None, imageFormat=defaultImageFormat, quality=defaultQuality, cache=None,
+        optimize=False, info=None
+):
+    imageText, imagePath = cellData[:2]
+    content = cellData[2] if len(cellData) > 2 else None
+    start = time.perf_counter()
+    recorded = {}
+
+    # only the header of the image is read
+    with stats.measure('probe', recorded):
+        info = info or imageInfo(imagePath, content)
+    width, height = fitImage((info.width, info.height), cell, fontSize)
+
+    if dpi or optimize:
+        # the image is resampled to the pixels it needs at the requested resolution
+        # so that the full size image is not embedded in the PDF
+        with stats.measure('resample', recorded) as counters:
+            data = prepareImage(imagePath, info, width, height, dpi, imageFormat, quality, cache, content, optimize)
+            if isinstance(data, ImageData):
+                counters['read'] = len(content) if content is not None else os.path.getsize(imagePath)
+                counters['written'] = len(data.content)
+    else:
+        # reportlab will embed the original image
+        data = imagePath
+
+    if optimize:
+        size = len(content) if content is not None else os.path.getsize(imagePath)
+        written = len(data.content) if isinstance(data, ImageData) else size
+        stats.record(optimizePrefix + imageClass(info, data), 0.0, size, written, target=recorded)
+
+    if isinstance(data, ImageData):
+        # the content of the file is only used by the images drawn from it, not by the prepared ones
+        content = None
+
+    return Cell(imageText, imagePath, width, height, data, time.perf_counter() - start, recorded, content, info)
+
+
+# content hash of a file
+def fileHash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as imageFile:
+        for block in iter(lambda: imageFile.read(hashBlockSize), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+# content hash of an image file
+# with a store of metadata (see probe.useStore), the hashes of the files that have not changed are not computed again
+def imageHash(path):
+    store = probe.metadataStore
+    if store is None:
+        return fileHash(path)
+
+    stamp = fileStamp(path)
+    digest = store.digest(path, stamp)
+    if digest is None:
+        digest = fileHash(path)
+        store.putDigest(path, stamp, digest)
+    return digest
+
+
+# finds the images whose content is identical to a previous one
+# the images are compared by their content hash, but only the files with the same size as a previous one are hashed
+class Deduplicator:
+
+    def __init__(self):
+        self.bySize = {}  # file size -> [path, hash] of the previous images with that size (hash computed when needed)
+        self.jobs = {}  # path of a previous image -> its preparation (Future or Cell)
+        self.documents = {}  # path of a previous image -> document where it was drawn (see prepareCells)
+        self.duplicates = 0  # number of duplicated images
+        self.savedBytes = 0  # bytes of the images that were not read and embedded again
+        self.savedSeconds = 0.0  # time spent preparing the images that were not prepared again
+
+    # the path of a previous image with the same content or None if there is no such image
+    # content is the content of the file, if it has already been read
+    def previous(self, imagePath, content=None):
+        known = knownInfo(imagePath, knownFiles)
+        if known:
+            # given by the list file
+            size, digest = known
+        elif content is None:
+            size = os.path.getsize(imagePath)
+            digest = imageHash(imagePath) if self.bySize.get(size) else None
+        else:
+            # hashed now: the file may not be read again later (the images of an archive can't be, see archives.py)
+            size = len(content)
+            digest = hashlib.sha1(content).digest()
+        candidates = self.bySize.setdefault(size, [])
+
+        for candidate in candidates:
+            if candidate[1] is None:
+                # it was the only image with its size until now
+                candidate[1] = imageHash(candidate[0])
+            if candidate[1] == digest:
+                return candidate[0]
+
+        candidates.append([imagePath, digest])
+        return None
+
+    # a duplicated image is drawn using the image of the previous one
+    # it is scaled again because the cells of a page can have different sizes
+    def duplicate(self, cellData, previous, cell, fontSize):
+        self.duplicates += 1
+        self.savedSeconds += previous.seconds
+        self.savedBytes += len(cellData[2]) if len(cellData) > 2 and cellData[2] else os.path.getsize(cellData[1])
+        width, height = fitImage((previous.width, previous.height), cell, fontSize)
+        # the images drawn from the content of their files (see prepareCell) use the content of the duplicate,
+        # which is the same
+        content = cellData[2] if len(cellData) > 2 and not isinstance(previous.image, ImageData) else None
+        return previous._replace(
+            text=cellData[0], path=cellData[1], width=width, height=height, seconds=0.0, stages={}, content=content
+        )
+
+    def report(self):
+        print(
+            f'{self.duplicates} duplicated image/s: {self.savedBytes} bytes and {self.savedSeconds:.2f} seconds '
+            f'of image preparation saved'
+        )
+
+
+# value of an element of the preparation window
+# a Future in a pool of processes or a function that prepares the image when there is no pool
+def _result(job):
+    return job.result() if isinstance(job, Future) else job()
+
+
+# transforms the images generator into a generator of cells ready to be drawn, in the same order
+# with jobs > 1, the images are prepared in a pool of processes
+# readAhead is the maximum number of images being prepared or waiting to be drawn, so memory stays bounded
+# with deduplicate, an image identical to a previous one is not prepared again and reuses its image
+# with optimize, the images are prepared to be as small as possible (see prepareCell)
+# when the cells are drawn in several documents of documentPages pages (the parts of a streamed PDF),
+# an image identical to one drawn in a previous document is prepared again, as its content is no longer kept
+# the item used as page header (headerFlag) is not an image and is returned unchanged
+def prepareCells(
+        images, page, fontSize, dpi=None, imageFormat=defaultImageFormat, quality=defaultQuality,
+        jobs=1, readAhead=None, cache=None, deduplicate=False, documentPages=None, optimize=False
+):
+    options = (fontSize, dpi, imageFormat, quality, cache, optimize)
+    dedup = Deduplicator() if deduplicate else None
+
+    if jobs == 1:
+        # no pool, each image is prepared when it is going to be drawn
+        pool = nullcontext()
+        readAhead = 1
+    else:
+        jobs = jobs or os.cpu_count()
+        # the processes use the store of metadata of this one
+        pool = ProcessPoolExecutor(jobs, initializer=useStore, initargs=(probe.metadataStore,))
+        readAhead = readAhead or jobs * readAheadPerJob
+
+    with pool:
+        # images being prepared: (cellData, its cell, its preparation, path of the previous identical image)
+        window = deque()
+        cellIndex = 0  # index of the cell of the next image within its page
+        drawn = 0  # number of images already returned
+        documentImages = documentPages * page.numCells if documentPages else None
+
+        # the oldest image of the window, ready to be drawn
+        def nextCell():
+            nonlocal drawn
+            cellData, cell, job, previous = window.popleft()
+            if cellData[0] == headerFlag:
+                return cellData
+
+            document = drawn // documentImages if documentImages else 0
+            drawn += 1
+            if previous is not None:
+                if dedup.documents.get(previous, document) == document:
+                    return dedup.duplicate(cellData, _result(dedup.jobs[previous]), cell, fontSize)
+                # the previous image is in another document
+                job = partial(prepareCell, cellData, cell, *options)
+
+            cell = _result(job)
+            if dedup:
+                image = cell.image
+                if isinstance(image, ImageData):
+                    # once drawn, the image is in the PDF and its content is no longer needed by its duplicates
+                    image = image._replace(content=None)
+                key = previous or cellData[1]
+                dedup.jobs[key] = partial(cell._replace, image=image, content=None)
+                dedup.documents[key] = document
+            return cell
+
+        for cellData in images:
+            cell = job = previous = None
+            if cellData[0] != headerFlag:
+                cell = page.cells[cellIndex]
+                cellIndex = (cellIndex + 1) % page.numCells
+                previous = dedup.previous(*cellData[1:3]) if dedup else None
+                if previous is None:
+                    if jobs == 1:
+                        job = partial(prepareCell, cellData, cell, *options)
+                    else:
+                        # the information about the image given by the list file is sent, it isn't probed again
+                        job = pool.submit(prepareCell, cellData, cell, *options, info=knownInfo(cellData[1]))
+                    if dedup:
+                        dedup.jobs[cellData[1]] = job
+
+            window.append((cellData, cell, job, previous))
+            if len(window) >= readAhead:
+                # the window is full, wait for the oldest image before reading new ones
+                yield nextCell()
+
+        while window:
+            yield nextCell()
+
+    if dedup:
+        dedup.report()
@@ -0,0 +1,134 @@
+'''Plan of a catalog: the page and cell of each image and the estimated size of the PDF, without creating it'''
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from defaults import headerFlag, defaultImageFormat, scanThreads, planJPEGBytesPerPixel, planLosslessBytesPerPixel, \
+    planPageBytes
+from images import pixels, passThrough
+from pipeline import fitImage
+from probe import imageInfo, knownInfo, knownFiles
+
+
+# information about an image, reading only its header, and the size of its file
+# both can be known from the list file of the images, then the file is not accessed (see listfiles.py)
+# returns None if the image can't be read
+def probeFile(imagePath, content=None):
+    try:
+        if content is not None:
+            # an image of an archive (see archives.py)
+            return imageInfo(imagePath, content), len(content)
+        known = knownInfo(imagePath, knownFiles)
+        return imageInfo(imagePath), known[0] if known else os.path.getsize(imagePath)
+    except Exception:
+        # the creation of the catalog would stop at this image
+        return None
+
+
+# pixel size of an image in the PDF and estimated bytes it adds to the PDF
+# info is the information about the image (probe.ImageInfo) and fileSize the size of its file
+# width and height are the size (in points) of the image on the page
+# the rest of the parameters are those of createPDF (see images.prepareImage)
+def estimateImage(info, fileSize, width, height, dpi=None, imageFormat=defaultImageFormat, optimize=False):
+    size = info.width, info.height
+    if dpi:
+        size = min(pixels(width, dpi), info.width), min(pixels(height, dpi), info.height)
+
+    if size == (info.width, info.height) and imageFormat == defaultImageFormat and info.format == 'JPEG' and \
+            (passThrough(info) or not (dpi or optimize)):
+        # the file is embedded as it is
+        estimate = fileSize
+    else:
+        photograph = info.format == 'JPEG' or (optimize and info.mode not in ('P', 'RGBA', 'LA'))
+        jpeg = imageFormat == 'JPEG' or (imageFormat == defaultImageFormat and photograph)
+        bytesPerPixel = planJPEGBytesPerPixel if jpeg else planLosslessBytesPerPixel
+        if info.mode in ('1', 'L'):
+            bytesPerPixel /= 3
+        estimate = size[0] * size[1] * bytesPerPixel
+
+    if not optimize:
+        # the streams are encoded in ASCII85 (see images.binaryStreams)
+        estimate *= 5 / 4
+
+    return size, int(estimate)
+
+
+# the plan of a catalog: its header, number of pages and images, estimated size of the PDF and, for each image,
+# its page, cell, position and size on the page (in points), pixel size in the PDF and estimated bytes
+# the images that can't be read are listed apart (unreadable), they don't have a cell
+# images, page, fontSize, header and the rest of the parameters are those of createPDF
+# the headers of the images are read by a pool of threads
+def planCatalog(
+        images, page, fontSize, header=None, dpi=None, imageFormat=defaultImageFormat, optimize=False, firstPage=1,
+        threads=scanThreads
+):
+    images = iter(images)
+    first = next(images, None)
+    if first and first[0] == headerFlag:
+        # the header of the list file takes precedence over the header parameter
+        header = first[1]
+    elif first:
+        images = [first, *images]
+
+    # the images of an archive come with their content: they are probed now, so that it isn't kept
+    images = [item if len(item) < 3 else (*item[:2], probeFile(*item[1:])) for item in images]
+    cells = []
+    unreadable = []
+    estimatedBytes = 0
+
+    with ThreadPoolExecutor(threads) as pool:
+        probes = pool.map(lambda item: item[2] if len(item) > 2 else probeFile(item[1]), images)
+        for (imageText, imagePath, *_), probed in zip(images, probes):
+            if probed is None:
+                unreadable.append(imagePath)
+                continue
+
+            info, fileSize = probed
+            n = len(cells)
+            cell = page.cells[n % page.numCells]
+            width, height = fitImage((info.width, info.height), cell, fontSize)
+            size, estimate = estimateImage(info, fileSize, width, height, dpi, imageFormat, optimize)
+            estimatedBytes += estimate
+
+            cells.append(dict(
+                path=imagePath,
+                text=imageText,
+                page=firstPage + n // page.numCells,
+                cell=n % page.numCells,
+                col=cell.col,
+                row=cell.row,
+                x=cell.x,
+                y=cell.y,
+                width=width,
+                height=height,
+                pixels=size,
+                format=info.format,
+                bytes=estimate,
+            ))
+
+    numberOfpages = -(-len(cells) // page.numCells)
+    return dict(
+        header=header,
+        pages=numberOfpages,
+        images=len(cells),
+        estimatedBytes=estimatedBytes + numberOfpages * planPageBytes,
+        cells=cells,
+        unreadable=unreadable,
+    )
+
+
+# write a plan as JSON to a file name or to an open file
+# one cell per line: json.dump with indent uses the slow pure Python encoder, json.dumps without it doesn't
+def savePlan(plan, output):
+    if isinstance(output, str):
+        with open(output, 'w') as planFile:
+            savePlan(plan, planFile)
+        return
+
+    fields = {key: value for key, value in plan.items() if key != 'cells'}
+    output.write('{\n' + ''.join(f' {json.dumps(key)}: {json.dumps(value)},\n' for key, value in fields.items()))
+    output.write(' "cells": [\n')
+    for n, cell in enumerate(plan['cells']):
+        output.write('  ' + json.dumps(cell) + (',\n' if n < len(plan['cells']) - 1 else '\n'))
+    output.write(' ]\n}\n')
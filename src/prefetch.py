@@ -0,0 +1,116 @@
+'''Reading of the image files in advance, to hide the latency of slow storage'''
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from defaults import headerFlag
+import stats
+
+
+# bytes of the files being read or read in advance and not yet used, shared by the threads of the pool
+# the size of each file is reserved before it is read and released when its content is used
+# the files reserve their bytes in the order of the catalog (each one has a ticket): a file waits for the bytes
+# of the previous ones to be released, and never for those of the next ones, which are used after it
+class Budget:
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.used = 0
+        self.tickets = 0  # tickets given
+        self.turn = 0  # ticket of the next file to reserve its bytes
+        self.condition = threading.Condition()
+        self.closed = False  # the files are no longer used, nothing is released
+
+    def ticket(self):
+        self.tickets += 1
+        return self.tickets - 1
+
+    # reserve the size of a file, waiting for its turn and for the bytes to be available
+    # returns False if the file is larger than the maximum, or size is None (the file can't be read)
+    def reserve(self, ticket, size):
+        with self.condition:
+            fits = size is not None and size <= self.maxBytes
+            self.condition.wait_for(
+                lambda: self.closed or self.turn == ticket and (not fits or self.used + size <= self.maxBytes)
+            )
+            self.turn += 1
+            if fits:
+                self.used += size
+            self.condition.notify_all()
+            return fits
+
+    def release(self, size):
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+    # the files waiting for their turn don't wait any longer (the images are no longer used)
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+# content of a file, or None if it is larger than the budget or can't be read (it will be read, and fail, later)
+# returns the content, the bytes reserved for it in the budget and the time spent reading it
+def readFile(path, budget, ticket):
+    start = time.perf_counter()
+    content, size = None, None
+    try:
+        with open(path, 'rb') as imageFile:
+            size = os.fstat(imageFile.fileno()).st_size
+            if budget.reserve(ticket, size):
+                content = imageFile.read()
+            else:
+                size = 0
+    except OSError:
+        content = None
+    finally:
+        if size is None:
+            # the turn of the file is taken even if it can't be read, the next ones would wait for it
+            budget.reserve(ticket, None)
+            size = 0
+    return content, size, time.perf_counter() - start
+
+
+# transforms the images generator (text, path) into a generator of (text, path, content), in the same order
+# the next files are read at the same time by a pool of threads while the previous ones are being used
+# files is the maximum number of files read in advance
+# the reading of new files stops while the ones being read or already read and not returned reach maxBytes,
+# the files larger than maxBytes are not read in advance (their content is None)
+# the item used as page header (headerFlag) is not an image and is returned unchanged, as the images with content
+def prefetchImages(images, files, maxBytes):
+    budget = Budget(maxBytes)
+    with ThreadPoolExecutor(files) as pool:
+        window = deque()  # (item, reading of its file)
+
+        # the oldest item of the window, with its content
+        def nextItem():
+            item, job = window.popleft()
+            if job is None:
+                return item
+            content, reserved, seconds = job.result()
+            budget.release(reserved)
+            stats.record('prefetch', seconds, len(content) if content else 0)
+            return item + (content,)
+
+        try:
+            for item in images:
+                while window and (len(window) >= files or budget.used >= maxBytes):
+                    yield nextItem()
+
+                # the images of an archive already have their content (see archives.py)
+                job = None
+                if item[0] != headerFlag and len(item) == 2:
+                    job = pool.submit(readFile, item[1], budget, budget.ticket())
+                window.append((item, job))
+
+            while window:
+                yield nextItem()
+
+        finally:
+            # the generator can be closed before all the images are used (an error creating the catalog,...)
+            budget.close()
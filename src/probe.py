@@ -0,0 +1,173 @@
+'''Size and format of the images, reading only their headers'''
+
+import struct
+from collections import namedtuple, OrderedDict
+from io import BytesIO
+
+from PIL import Image
+
+from archives import fileStamp
+from defaults import knownImagesLimit
+
+
+# information about an image
+# width, height: size in pixels
+# format: JPEG, PNG, GIF,... (as named by PIL)
+# mode: color mode (as named by PIL): L, RGB, CMYK, P, RGBA,...
+# baseline: the image is a baseline JPEG (8 bits, not progressive)
+ImageInfo = namedtuple('ImageInfo', 'width height format mode baseline', defaults=(False,))
+
+
+# information about the images probed most recently, by path, at most limit of them
+# the oldest ones are forgotten (and probed again if they are needed), so the memory used doesn't grow with the catalog
+class KnownImages(OrderedDict):
+
+    def __init__(self, limit=knownImagesLimit):
+        super().__init__()
+        self.limit = limit
+
+    def __setitem__(self, imagePath, info):
+        super().__setitem__(imagePath, info)
+        self.move_to_end(imagePath)
+        while len(self) > self.limit:
+            oldest, _ = self.popitem(last=False)
+            knownStamps.pop(oldest, None)
+
+
+# information about the images already probed, by path
+# it is shared by the layout of the pages and the preparation of the images
+knownImages = KnownImages()
+
+# in long-running processes (see server.py) the files can change between catalogs
+# with revalidate, the images already probed are probed again if their modification time or size has changed
+revalidate = False
+knownStamps = {}  # modification time and size of the images probed, by path (only with revalidate)
+
+# size in bytes and content hash (sha1 digest) of the files, by path, when given by a list file (see listfiles.py)
+knownFiles = {}
+
+# persistent store of the information about the images and the hashes of their files (metadata.MetadataStore), if any
+# it is shared by all the runs and processes: it is set in each process that probes images (see useStore)
+metadataStore = None
+
+# JPEG markers: start of frame (they contain the size of the image), without length and end of the headers
+jpegSOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+jpegBaseline = {0xC0, 0xC1}  # sequential Huffman coding
+jpegStandalone = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+jpegEnd = {0xD9, 0xDA}
+
+# color modes of the JPEG images (by number of components) and of the PNG images (by color type)
+jpegModes = {1: 'L', 3: 'RGB', 4: 'CMYK'}
+pngModes = {0: 'L', 2: 'RGB', 3: 'P', 4: 'LA', 6: 'RGBA'}
+
+
+# size of a JPEG image read from the start of frame segment
+# the segments before it (EXIF, color profiles,...) are skipped without reading them
+def _jpegInfo(imageFile):
+    imageFile.seek(2)  # after the start of image marker
+    while True:
+        if imageFile.read(1) != b'\xff':
+            return None  # not a marker, corrupt file
+
+        marker = imageFile.read(1)
+        while marker == b'\xff':
+            # markers can be preceded by any number of fill bytes
+            marker = imageFile.read(1)
+
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in jpegStandalone:
+            continue
+        if marker in jpegEnd:
+            return None
+
+        length, = struct.unpack('>H', imageFile.read(2))
+        if marker in jpegSOF:
+            precision, height, width, components = struct.unpack('>BHHB', imageFile.read(6))
+            if not (width and height and components in jpegModes):
+                return None
+            baseline = marker in jpegBaseline and precision == 8
+            return ImageInfo(width, height, 'JPEG', jpegModes[components], baseline)
+
+        imageFile.seek(length - 2, 1)
+
+
+# the file of an image, or its content if it has already been read (see prefetch.py), to be opened by PIL
+def imageSource(imagePath, content=None):
+    return imagePath if content is None else BytesIO(content)
+
+
+# size of an image reading only its header: JPEG start of frame, PNG IHDR chunk or GIF logical screen descriptor
+# returns None if the format is not recognized
+def headerInfo(imagePath, content=None):
+    with (open(imagePath, 'rb') if content is None else BytesIO(content)) as imageFile:
+        header = imageFile.read(26)
+
+        if header.startswith(b'\xff\xd8'):
+            return _jpegInfo(imageFile)
+
+        if header.startswith(b'\x89PNG\r\n\x1a\n') and header[12:16] == b'IHDR':
+            width, height, bitDepth, colorType = struct.unpack('>IIBB', header[16:26])
+            if colorType in pngModes and (bitDepth == 8 or colorType == 3):
+                # other bit depths have their own modes in PIL
+                return ImageInfo(width, height, 'PNG', pngModes[colorType])
+
+        elif header[:6] in (b'GIF87a', b'GIF89a'):
+            width, height = struct.unpack('<HH', header[6:10])
+            return ImageInfo(width, height, 'GIF', 'P')
+
+    return None
+
+
+# the information about an image or the size and hash of its file (knownFiles) already known, or None
+# it can be used without accessing the file, except with revalidate: then it is never returned
+def knownInfo(imagePath, known=knownImages):
+    return None if revalidate else known.get(imagePath)
+
+
+# use a store of metadata (metadata.MetadataStore) in this process, or none
+# it is also the initializer of the pools of processes that probe images
+def useStore(store):
+    global metadataStore
+    metadataStore = store
+
+
+# information about an image
+# the header is read directly, PIL is only used for the unusual files
+# content is the content of the file, if it has already been read
+# with a store of metadata, the images that have not changed since they were stored are not opened
+def imageInfo(imagePath, content=None):
+    stamp = None
+    if revalidate:
+        stamp = fileStamp(imagePath)
+
+    info = knownImages.get(imagePath)
+    if info and (stamp is None or knownStamps.get(imagePath) == stamp):
+        knownImages.move_to_end(imagePath)
+        return info
+
+    store = metadataStore if content is None else None
+    info = None
+    if store is not None:
+        stamp = stamp or fileStamp(imagePath)
+        info = store.info(imagePath, stamp)
+
+    if not info:
+        try:
+            info = headerInfo(imagePath, content)
+        except struct.error:
+            info = None  # truncated header
+
+        if not info:
+            with Image.open(imageSource(imagePath, content)) as image:
+                baseline = image.format == 'JPEG' and not image.info.get('progressive')
+                info = ImageInfo(image.width, image.height, image.format, image.mode, baseline)
+
+        if store is not None:
+            store.putInfo(imagePath, stamp, info)
+
+    knownImages[imagePath] = info
+    if revalidate:
+        knownStamps[imagePath] = stamp
+    return info
@@ -0,0 +1,55 @@
+'''Scanning of the folders of images'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from defaults import imageFileExtensions, scanThreads
+
+
+# images and subfolders of a folder, both sorted by name
+# the type of each entry is taken from the folder listing: the files without an allowed extension are never
+# examined and the subfolders (and images) whose path contains the exclusion pattern are skipped
+# symbolic links to folders are not followed
+def scanFolder(folder, excludePattern=None):
+    images, folders = [], []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if excludePattern and excludePattern in entry.path:
+                # everything below it contains the pattern too
+                continue
+            _, extension = os.path.splitext(entry.name)
+            if extension in imageFileExtensions and entry.is_file():
+                images.append(entry)
+            elif entry.is_dir(follow_symlinks=False):
+                folders.append(entry)
+
+    return (
+        [entry.path for entry in sorted(images, key=lambda entry: entry.name)],
+        [entry.path for entry in sorted(folders, key=lambda entry: entry.name)]
+    )
+
+
+# generator of the paths of the images of a folder and, if recursive, of its subfolders
+# the images of each folder come first, sorted by name, and then those of its subfolders, in the same order
+# the folders are listed in advance by a pool of threads, which hides the latency of network file systems
+def scanImages(folder, recursive=False, excludePattern=None, threads=scanThreads):
+    if not recursive:
+        yield from scanFolder(folder, excludePattern)[0]
+        return
+
+    with ThreadPoolExecutor(threads) as pool:
+        # folders being listed, the next one to be returned at the end
+        pending = [pool.submit(scanFolder, folder, excludePattern)]
+        while pending:
+            images, folders = pending.pop().result()
+            yield from images
+            pending.extend(pool.submit(scanSubfolder, subfolder, excludePattern) for subfolder in reversed(folders))
+
+
+# images and subfolders of a subfolder (see scanFolder)
+# as in os.walk, the subfolders that can't be listed (without permission, deleted while scanning,...) are skipped
+def scanSubfolder(folder, excludePattern=None):
+    try:
+        return scanFolder(folder, excludePattern)
+    except OSError:
+        return [], []
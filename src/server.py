@@ -0,0 +1,246 @@
+'''
+Server that creates catalogs on demand, keeping the modules loaded and the images in memory between them.
+The jobs are received through HTTP on a local address or on a Unix socket, with the same arguments as imatologue.py
+(a JSON list in the body of a POST to /catalog), and several of them are created at the same time by a pool of
+processes. Each process keeps the sizes of the images it has probed and the images it has resampled, so the next
+catalogs of the same images don't read or resample them again.
+More information by running the script with the -h parameter.
+'''
+
+import argparse
+import io
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout, redirect_stderr
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+
+from defaults import serverHost, serverPort, serverWorkers, serverMemory, megabyte, \
+    standardOutput
+
+# cache of the resampled images of the process (cache.MemoryCache), created when the process starts
+memoryCache = None
+
+
+# load the modules and create the caches of a process of the pool
+def startWorker(memory):
+    global memoryCache
+
+    import imatologue  # reportlab and its fonts are loaded only once
+    from cache import MemoryCache
+    import probe
+
+    memoryCache = MemoryCache(memory)
+    probe.revalidate = True  # the images can change between two catalogs
+
+
+# create a catalog in a process of the pool
+# arguments are the ones of the command line of imatologue.py
+# returns a dictionary with the HTTP status, the messages of the job and either the result or the error
+# with the output file -, the PDF is returned in the pdf field instead of being written to a file
+# with --plan, the catalog is planned instead (see runPlan)
+# --watch never ends, it can't be used by a job
+def runJob(arguments):
+    from cliparser import parseArgs
+    from imatologue import createCatalog
+    import stats
+
+    log = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(log), redirect_stderr(log):
+        try:
+            args = parseArgs(arguments)
+        except SystemExit:
+            # argparse has written the error to the log
+            return dict(status=400, error='Invalid arguments', log=log.getvalue())
+
+        if args.watch:
+            return dict(status=400, error='--watch can not be used by the jobs of the server', log=log.getvalue())
+
+        output = io.BytesIO() if args.outputFileName == standardOutput else None
+        stats.reset()
+        try:
+            if args.plan:
+                result = runPlan(args)
+            else:
+                numberOfpages, numberOfimages = createCatalog(args, output, memoryCache)
+        except Exception as e:
+            return dict(status=500, error=str(e), log=log.getvalue())
+
+    if args.plan:
+        return dict(result, status=200, seconds=time.perf_counter() - start, log=log.getvalue())
+
+    return dict(
+        status=200,
+        pages=numberOfpages,
+        images=numberOfimages,
+        output=None if output else args.outputFileName,
+        seconds=time.perf_counter() - start,
+        log=log.getvalue(),
+        pdf=output.getvalue() if output else None
+    )
+
+
+# plan a catalog in a process of the pool (see imatologue.createPlan)
+# returns the number of pages and images and the name of the plan file
+# or, with the output file -, the plan itself in the plan field
+def runPlan(args):
+    from imatologue import createPlan, planName
+
+    if args.outputFileName == standardOutput:
+        # the plan is not written to the messages of the job
+        with redirect_stdout(io.StringIO()):
+            plan = createPlan(args)
+        return dict(pages=plan['pages'], images=plan['images'], output=None, plan=plan)
+
+    plan = createPlan(args)
+    return dict(pages=plan['pages'], images=plan['images'], output=planName(args), plan=None)
+
+
+# requests of the server
+# POST /catalog with a JSON list of arguments: creates the catalog, the response is a JSON object with the number
+# of pages and images, the name of the PDF and the messages; with the output file - the response is the PDF itself
+# with --plan, the response is a JSON object with the name of the plan file or, with the output file -, the plan
+# GET /status: number of processes and of jobs received, running and finished
+class CatalogHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        if self.path != '/catalog':
+            self._reply(404, dict(error=f'Unknown path: {self.path}'))
+            return
+
+        try:
+            arguments = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not (isinstance(arguments, list) and all(isinstance(argument, str) for argument in arguments)):
+                raise ValueError
+        except ValueError:
+            self._reply(400, dict(error='The body must be a JSON list of arguments'))
+            return
+
+        server = self.server
+        server.count('received')
+        try:
+            result = server.pool.submit(runJob, arguments).result()
+        except Exception as e:
+            # the process creating the catalog has failed
+            result = dict(status=500, error=str(e) or type(e).__name__)
+        finally:
+            server.count('finished')
+
+        pdf = result.pop('pdf', None)
+        if pdf is not None:
+            self._reply(200, pdf, 'application/pdf', {'X-Pages': result['pages'], 'X-Images': result['images']})
+        else:
+            self._reply(result['status'], result)
+
+    def do_GET(self):
+        if self.path != '/status':
+            self._reply(404, dict(error=f'Unknown path: {self.path}'))
+            return
+
+        server = self.server
+        with server.lock:
+            jobs = dict(server.jobs)
+        self._reply(200, dict(workers=server.workers, running=jobs['received'] - jobs['finished'], **jobs))
+
+    def _reply(self, status, body, contentType='application/json', headers=None):
+        if contentType == 'application/json':
+            body = json.dumps(body).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # the clients of a Unix socket have no address
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+# the pool of processes and the number of jobs, shared by the HTTP and the Unix socket servers
+class CatalogServer:
+
+    def setUp(self, workers, memory):
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(workers, mp_context=get_context('spawn'), initializer=startWorker,
+                                        initargs=(memory,))
+        self.lock = threading.Lock()
+        self.jobs = dict(received=0, finished=0)
+
+        # the processes are started and their modules loaded before the first job arrives
+        for future in [self.pool.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+
+    def count(self, name):
+        with self.lock:
+            self.jobs[name] += 1
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+
+
+class HTTPCatalogServer(CatalogServer, ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class UnixCatalogServer(CatalogServer, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_close(self):
+        super().server_close()
+        os.remove(self.server_address)
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description='Server that creates catalogs, keeping the images in memory.')
+
+    parser.add_argument('--host', default=serverHost, help=f'Address of the HTTP server. Default: {serverHost}')
+    parser.add_argument('--port', type=int, default=serverPort, help=f'Port of the HTTP server. Default: {serverPort}')
+    parser.add_argument('--socket', help='Unix socket to listen on instead of the HTTP address')
+    parser.add_argument(
+        '-w', '--workers', type=int, default=serverWorkers,
+        help=f'Number of processes creating catalogs at the same time. Default: {serverWorkers}'
+    )
+    parser.add_argument(
+        '--memory', type=int, default=serverMemory // megabyte,
+        help=f'Memory of each process for the resampled images, in MB. Default: {serverMemory // megabyte}'
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            # left by a previous server
+            os.remove(args.socket)
+        server = UnixCatalogServer(args.socket, CatalogHandler)
+        address = args.socket
+    else:
+        server = HTTPCatalogServer((args.host, args.port), CatalogHandler)
+        address = f'http://{args.host}:{args.port}'
+
+    with server:
+        server.setUp(args.workers, args.memory * megabyte)
+        print(f'Creating catalogs on {address} with {args.workers} process/es')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    return 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
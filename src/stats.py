@@ -0,0 +1,136 @@
+'''Time, number of calls and bytes read and written by each stage of the creation of a catalog'''
+
+import json
+import sys
+import time
+from contextlib import contextmanager
+from functools import wraps
+from inspect import isgeneratorfunction
+
+from defaults import progressInterval
+
+# statistics of each stage: name -> [calls, seconds, bytes read, bytes written]
+# they are recorded in the process that runs the stage, the stages run in other processes are merged (see merge)
+stages = {}
+
+
+# forget the statistics recorded until now
+def reset():
+    stages.clear()
+
+
+# add a call to a stage
+# target is where the statistics are recorded, a dictionary like stages (see measure)
+def record(name, seconds=0.0, read=0, written=0, calls=1, target=None):
+    entry = (stages if target is None else target).setdefault(name, [0, 0.0, 0, 0])
+    entry[0] += calls
+    entry[1] += seconds
+    entry[2] += read
+    entry[3] += written
+
+
+# add the statistics recorded in another process: {name: (calls, seconds, read, written)}
+def merge(recorded):
+    for name, (calls, seconds, read, written) in recorded.items():
+        record(name, seconds, read, written, calls)
+
+
+# measure a block of code as a call to a stage
+# the bytes can be set in the dictionary returned: with stats.measure('save') as counters: counters['written'] = n
+# with a target, the call is recorded there instead of in stages (to be sent to another process and merged)
+@contextmanager
+def measure(name, target=None):
+    counters = {'read': 0, 'written': 0}
+    start = time.perf_counter()
+    try:
+        yield counters
+    finally:
+        record(name, time.perf_counter() - start, counters['read'], counters['written'], target=target)
+
+
+# the time spent producing each item of an iterator, each item is a call to the stage
+def timedIterator(name, iterator):
+    iterator = iter(iterator)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            seconds = time.perf_counter() - start
+        record(name, seconds)
+        yield item
+
+
+# decorator that records each call to a function as a call to a stage
+# for generator functions, the time spent producing each item is recorded (see timedIterator)
+def timed(name):
+    def decorator(function):
+        if isgeneratorfunction(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                return timedIterator(name, function(*args, **kwargs))
+        else:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+# the statistics as a dictionary that can be written as JSON
+def asDict():
+    return {
+        name: dict(calls=calls, seconds=seconds, bytesRead=read, bytesWritten=written)
+        for name, (calls, seconds, read, written) in stages.items()
+    }
+
+
+# print a table with the statistics of each stage
+def printStats():
+    width = max([12] + [len(name) + 2 for name in stages])
+    print(f"{'stage':<{width}}{'calls':>10}{'seconds':>12}{'bytes read':>16}{'bytes written':>16}")
+    for name, (calls, seconds, read, written) in stages.items():
+        print(f'{name:<{width}}{calls:>10}{seconds:>12.3f}{read:>16}{written:>16}')
+
+
+# write the statistics to a JSON file, together with other information about the run (extra)
+def saveStats(fileName, **extra):
+    with open(fileName, 'w') as statsFile:
+        json.dump(dict(extra, stages=asDict()), statsFile, indent=2)
+
+
+# a line that shows the progress of the creation of the catalog
+# it is printed at most once each interval seconds, printing every image slows down large catalogs
+# in a terminal the line is rewritten, otherwise a new line is printed each time
+class Progress:
+
+    def __init__(self, interval=progressInterval):
+        self.interval = interval
+        self.last = time.perf_counter()
+        self.line = None
+
+    def update(self, images, pages, path):
+        self.line = f'{images} image/s added to {pages} page/s, last one: {path}'
+        now = time.perf_counter()
+        if now - self.last >= self.interval:
+            self.last = now
+            self._print()
+
+    def finish(self):
+        if self.line:
+            self._print()
+            if sys.stdout.isatty():
+                print()
+
+    def _print(self):
+        if sys.stdout.isatty():
+            # the previous line is overwritten
+            print('\r\033[K' + self.line, end='', flush=True)
+        else:
+            print(self.line)
@@ -0,0 +1,114 @@
+'''Verification of the images before the catalog is created, the damaged ones are left out instead of stopping it'''
+
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+from PIL import Image, UnidentifiedImageError
+
+from defaults import headerFlag, verifyChunk, verifyTailBytes, verifyEndMarkers
+from probe import imageInfo, imageSource, knownImages, useStore
+import probe
+import stats
+
+
+# the last bytes of an image: its content or the end of its file
+def _tail(imagePath, content):
+    if content is not None:
+        return content[-verifyTailBytes:]
+    with open(imagePath, 'rb') as imageFile:
+        imageFile.seek(max(0, os.fstat(imageFile.fileno()).st_size - verifyTailBytes))
+        return imageFile.read()
+
+
+# check an image: its header can be read, it has pixels and the end marker of its format is near the end of the file
+# with decode, all its pixels are decoded too (slower, but it finds the damaged data inside the file)
+# content is the content of the file, if it has already been read (the images of an archive)
+# returns the information about the image (probe.ImageInfo) and None, or None and the error found
+def checkImage(imagePath, content=None, decode=False):
+    try:
+        info = imageInfo(imagePath, content)
+        if not (info.width and info.height):
+            return None, 'the image has no pixels'
+
+        marker = verifyEndMarkers.get(info.format)
+        if marker and marker not in _tail(imagePath, content):
+            return None, f'the {info.format} file is truncated'
+
+        if decode:
+            with Image.open(imageSource(imagePath, content)) as image:
+                image.load()
+
+    except UnidentifiedImageError:
+        # its message names the file or, for the images of an archive, a buffer
+        return None, 'the format of the image can not be identified'
+    except Exception as e:
+        return None, str(e) or e.__class__.__name__
+
+    return info, None
+
+
+# check a chunk of images: [(path, content or None)], returns [(path, info, error)]
+def checkImages(images, decode=False):
+    return [(imagePath, *checkImage(imagePath, content, decode)) for imagePath, content in images]
+
+
+# verify the images of a catalog before it is created (see checkImage)
+# images is the iterator of the images (see imatologue.imagesIterator), it is read to the end
+# the images are checked in chunks by a pool of jobs processes (0 for one per CPU), without pool with one job
+# returns the list of the valid images, without the content of the images of an archive,
+# and the list of the images left out: [(path, error)]
+# the information about the valid images is kept (probe.knownImages), so they are not probed again
+def verifyImages(images, decode=False, jobs=1):
+    items = []
+    quarantined = {}  # path -> error
+
+    jobs = jobs or os.cpu_count()
+    # the processes use the store of metadata of this one
+    pool = ProcessPoolExecutor(jobs, initializer=useStore, initargs=(probe.metadataStore,)) if jobs > 1 else None
+
+    def store(results):
+        for imagePath, info, error in results:
+            if error:
+                quarantined[imagePath] = error
+            else:
+                knownImages[imagePath] = info
+
+    with stats.measure('verify'), pool or nullcontext():
+        window = deque()  # chunks being checked, a few per process so that the images waiting don't fill the memory
+
+        def submit(chunk):
+            if pool is None:
+                store(checkImages(chunk, decode))
+                return
+            window.append(pool.submit(checkImages, chunk, decode))
+            if len(window) > 2 * jobs:
+                store(window.popleft().result())
+
+        chunk = []
+        for item in images:
+            items.append(item[:2])
+            if item[0] == headerFlag:
+                continue
+            chunk.append((item[1], item[2] if len(item) > 2 else None))
+            if len(chunk) >= verifyChunk:
+                submit(chunk)
+                chunk = []
+        if chunk:
+            submit(chunk)
+        while window:
+            store(window.popleft().result())
+
+    valid = [item for item in items if item[0] == headerFlag or item[1] not in quarantined]
+    return valid, list(quarantined.items())
+
+
+# write the images left out to a JSON file
+def saveQuarantine(fileName, quarantined, images):
+    with open(fileName, 'w') as quarantineFile:
+        json.dump(
+            dict(images=images, quarantined=[dict(path=path, error=error) for path, error in quarantined]),
+            quarantineFile, indent=2
+        )
@@ -0,0 +1,190 @@
+'''Watching of the folder of images (or the list file), to update the catalog when it changes'''
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from defaults import imageFileExtensions, watchInterval, watchMaxDelay
+from scanner import scanSubfolder, scanImages
+
+# inotify events (see inotify(7))
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_ONLYDIR = 0x01000000
+
+watchedEvents = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+    IN_DELETE_SELF | IN_MOVE_SELF
+
+# header of each event read from inotify: watch descriptor, mask, cookie and length of the name
+eventHeader = struct.Struct('iIII')
+
+
+# the change of a name is relevant if it is an image, a folder (recursive) or the list file
+# the hidden names are ignored: the temporary files of the catalog and its manifest start with a dot
+def relevant(path, isFolder, listFile, excludePattern):
+    name = os.path.basename(path)
+    if name.startswith('.') or (excludePattern and excludePattern in path):
+        return False
+    if listFile:
+        return path == listFile
+    return isFolder or os.path.splitext(name)[1] in imageFileExtensions
+
+
+# watcher that uses inotify (Linux), called through ctypes
+# the folder and, if recursive, its subfolders are watched, including the ones created later
+# if the source is a list file, its folder is watched and only the changes of the file are relevant
+class InotifyWatcher:
+
+    def __init__(self, source, recursive=False, excludePattern=None):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify is not available')
+
+        self.recursive = recursive
+        self.excludePattern = excludePattern
+        self.listFile = None
+        self.folders = {}  # watch descriptor -> folder
+
+        if os.path.isfile(source):
+            self.listFile = os.path.realpath(source)
+            self._watch(os.path.dirname(self.listFile))
+        else:
+            self._watchTree(source)
+
+    def _watch(self, folder):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), watchedEvents | IN_ONLYDIR)
+        if wd >= 0:
+            self.folders[wd] = folder
+
+    # a folder and, if recursive, its subfolders
+    def _watchTree(self, folder):
+        self._watch(folder)
+        if self.recursive:
+            for subfolder in scanSubfolder(folder, self.excludePattern)[1]:
+                self._watchTree(subfolder)
+
+    # wait until there are relevant changes or timeout seconds have passed (None: no limit)
+    # returns True if there have been changes
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not select.select([self.fd], [], [], remaining)[0]:
+                return False
+            if self._read():
+                return True
+
+    # read the pending events, returns True if any of them is relevant
+    def _read(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+
+        changed = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = eventHeader.unpack_from(data, offset)
+            offset += eventHeader.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # events have been lost
+                changed = True
+                continue
+
+            folder = self.folders.get(wd)
+            if folder is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed = changed or not self.listFile
+                continue
+
+            path = os.path.join(folder, os.fsdecode(name))
+            isFolder = bool(mask & IN_ISDIR)
+            if isFolder and not self.recursive:
+                continue
+            if relevant(path, isFolder, self.listFile, self.excludePattern):
+                changed = True
+                if isFolder and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watchTree(path)
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+# watcher that scans the folder every interval seconds, when inotify is not available
+# the images (or the list file) are compared by modification time and size
+class PollingWatcher:
+
+    def __init__(self, source, recursive=False, excludePattern=None, interval=watchInterval):
+        self.source = source
+        self.recursive = recursive
+        self.excludePattern = excludePattern
+        self.interval = interval
+        self.snapshot = self._snapshot()
+
+    def _snapshot(self):
+        paths = [self.source] if os.path.isfile(self.source) else \
+            scanImages(self.source, self.recursive, self.excludePattern)
+        snapshot = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # deleted while scanning
+            snapshot[path] = stat.st_mtime_ns, stat.st_size
+        return snapshot
+
+    # wait until there are changes or timeout seconds have passed (None: no limit)
+    # returns True if there have been changes
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+            if remaining > 0:
+                time.sleep(remaining)
+            snapshot = self._snapshot()
+            if snapshot != self.snapshot:
+                self.snapshot = snapshot
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def close(self):
+        pass
+
+
+# a watcher of the images of a catalog: inotify if it is available, otherwise polling
+def folderWatcher(source, recursive=False, excludePattern=None):
+    try:
+        return InotifyWatcher(source, recursive, excludePattern)
+    except (OSError, AttributeError):
+        # not Linux
+        return PollingWatcher(source, recursive, excludePattern)
+
+
+# wait until the images change and then until they don't change for delay seconds
+# a burst of changes (images being copied) gives a single update, after at most maxDelay seconds
+def waitForChanges(watcher, delay, maxDelay=watchMaxDelay):
+    watcher.wait()
+    start = time.monotonic()
+    while True:
+        remaining = maxDelay - (time.monotonic() - start)
+        if remaining <= 0 or not watcher.wait(min(delay, remaining)):
+            return
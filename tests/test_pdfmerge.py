@@ -0,0 +1,97 @@
+'''Round trip of the concatenation of PDF documents (pdfmerge.py)'''
+
+import io
+import os
+import re
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from reportlab.pdfgen import canvas
+
+from pdfmerge import PDFReader, PDFWriter
+
+images = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test_files', 'images')
+
+# a title, a text and a link with parentheses, escapes, dictionary delimiters and something that looks like a reference
+title = 'Catalog (1 0 R) << >>'
+text = r'Photo (2) \ 3 0 R ) end'
+link = 'http://example.com/(1 0 R)>>/Kids'
+
+
+# a document of pages pages, each one with the same image and text
+def createDocument(fileName, pages):
+    pdfCanvas = canvas.Canvas(fileName, pageCompression=0)
+    pdfCanvas.setTitle(title)
+    for page in range(pages):
+        pdfCanvas.drawImage(os.path.join(images, 'ball_blue_0.jpg'), 100, 100, 200, 200)
+        pdfCanvas.drawString(100, 400, f'{text} {page}')
+        # the link is an annotation of the page, a dictionary that is copied with its string
+        pdfCanvas.linkURL(link, (100, 100, 300, 300))
+        pdfCanvas.showPage()
+    pdfCanvas.save()
+
+
+class MergeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.first = os.path.join(self.folder.name, 'first.pdf')
+        self.second = os.path.join(self.folder.name, 'second.pdf')
+        createDocument(self.first, 2)
+        createDocument(self.second, 3)
+
+        output = io.BytesIO()
+        writer = PDFWriter(output)
+        for fileName in (self.first, self.second):
+            with PDFReader(fileName) as reader:
+                writer.addPages(reader)
+                writer.release(reader)
+        writer.close()
+        self.pageCount = writer.pageCount
+        self.merged = output.getvalue()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_pages(self):
+        self.assertEqual(self.pageCount, 5)
+        reader = PDFReader('merged.pdf', self.merged)
+        self.assertEqual(len(reader.pages), 5)
+
+    def test_offsets(self):
+        # each entry of the cross-reference table points to the start of its object
+        reader = PDFReader('merged.pdf', self.merged)
+        self.assertTrue(reader.offsets)
+        for number, offset in reader.offsets.items():
+            self.assertTrue(self.merged.startswith(b'%d 0 obj' % number, offset), number)
+            reader.object(number)
+
+    def test_strings(self):
+        # the strings are copied unchanged: the escaped parentheses and the references inside them
+        strings = []
+        for fileName in (self.first, self.second):
+            with open(fileName, 'rb') as pdfFile:
+                strings += re.findall(rb'\((?:\\.|[^\\)])*\) Tj', pdfFile.read())
+        self.assertEqual(len(strings), 5)
+        for string in strings:
+            self.assertIn(string, self.merged)
+
+        # the link has no references: it is identical in all the pages and written once
+        self.assertEqual(self.merged.count(rb'(http://example.com/\(1 0 R\)>>/Kids)'), 1)
+        # and the entries of its dictionary after the string too
+        self.assertIsNotNone(re.search(rb'/Kids\)\s*>>\s*/Border \[ 0 0 0 \] /Rect \[ 100 100 300 300 \]', self.merged))
+
+        reader = PDFReader('merged.pdf', self.merged)
+        self.assertIn(rb'/Title (Catalog \(1 0 R\) << >>)', reader.object(reader.info)[0])
+
+    def test_deduplication(self):
+        # the image is identical in both documents, it is written once
+        self.assertEqual(len(re.findall(rb'/Subtype\s*/Image', self.merged)), 1)
+
+
+if __name__ == '__main__':
+
+    unittest.main()